@@ -0,0 +1,108 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(question):
+    # Questions that differ only in case, spacing or trailing punctuation
+    # share a cache entry
+    question = re.sub(r'\s+', ' ', question).strip().casefold()
+    return question.rstrip(' ?!.')
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class AnswerCache:
+    """Process-wide LRU cache of answers with a TTL and request coalescing.
+
+    `get_or_compute` returns a cached value when there is one. Otherwise the
+    first caller for a key runs `compute` while concurrent callers for the
+    same key wait for its result instead of sending the same request again.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, version=None):
+        # Drop every entry, e.g. after the indexed documents changed
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+    def set_version(self, version):
+        # Invalidate the cache when the data it was built from changed
+        if version != self.version:
+            self.invalidate(version)
+
+    def get_or_compute(self, key, compute, should_cache=None, wait_timeout=120):
+        """Return (value, cached) for `key`, running `compute()` on a miss.
+
+        Values for which `should_cache(value)` is false, such as an answer cut
+        off by a deadline, are neither stored nor handed to waiting callers,
+        which then compute their own.
+        """
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value, True
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            in_flight.event.wait(wait_timeout)
+            if in_flight.value is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return in_flight.value, True
+            # The first request failed, timed out or gave an answer not worth
+            # sharing; answer this one directly
+            return compute(), False
+
+        try:
+            value = compute()
+            with self._lock:
+                self.misses += 1
+                if should_cache is None or should_cache(value):
+                    self._put(key, value)
+                    in_flight.value = value
+            return value, False
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            in_flight.event.set()
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+
+import httpx
+from google.genai import errors
+
+from gemini_client import BULK, RETRYABLE_CODES, RateLimiter
+from llm import MODEL_NAME, build_config, create_client, extract_sources, read_store_name
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Answer questions from a JSONL file with Gemini File Search."
+    )
+    parser.add_argument(
+        'input',
+        help='JSONL file with one {"id": ..., "question": ...} object per line'
+    )
+    parser.add_argument(
+        '--output', default=None,
+        help="JSONL file for the results (default: <input>.answers.jsonl)"
+    )
+    parser.add_argument('--concurrency', type=int, default=8, help="Maximum parallel requests (default: 8)")
+    parser.add_argument('--retries', type=int, default=4, help="Retries per question on transient errors (default: 4)")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds per request attempt, not counting the wait for the rate limit (default: 120)")
+    parser.add_argument('--model', default=MODEL_NAME, help=f"Model name (default: {MODEL_NAME})")
+    parser.add_argument('--store', default=None, help="File Search store name (default: from file_search_store_name.txt)")
+    parser.add_argument('--metadata-filter', default=None, help='Optional File Search metadata filter, e.g. "is_news = 1"')
+    parser.add_argument(
+        '--requests-per-minute', type=int, default=None,
+        help="Requests per minute the batch may use; keep it below the key's quota when the chat shares the key (default: no limit)"
+    )
+    parser.add_argument('--tokens-per-minute', type=int, default=None, help="Tokens per minute the batch may use (default: no limit)")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    for option, value in (('--requests-per-minute', args.requests_per_minute), ('--tokens-per-minute', args.tokens_per_minute)):
+        if value is not None and value < 1:
+            parser.error(f"{option} must be positive")
+    if args.output is None:
+        args.output = str(Path(args.input).with_suffix('.answers.jsonl'))
+    return args
+
+
+def read_questions(path):
+    questions = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            question = item.get('question')
+            if not question:
+                print(f"Warning: line {line_num} has no question, skipping")
+                continue
+            questions.append((str(item.get('id', line_num)), question))
+    return questions
+
+
+def read_finished_ids(path):
+    # Questions with a successful result in an earlier run are not asked again
+    finished = set()
+    if not Path(path).exists():
+        return finished
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted run
+                continue
+            if result.get('error') is None:
+                finished.add(result['id'])
+    return finished
+
+
+def is_retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_CODES
+    return isinstance(error, (httpx.HTTPError, asyncio.TimeoutError, ConnectionError))
+
+
+async def answer_question(client, args, config, question_id, question):
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_started = time.perf_counter()
+        try:
+            # The client's timeout covers the request only, not the wait for
+            # the rate limiter
+            response = await client.aio.models.generate_content(
+                model=args.model, contents=question, config=config
+            )
+            return {
+                'id': question_id,
+                'question': question,
+                'answer': response.text,
+                'sources': extract_sources(response),
+                'latency': round(time.perf_counter() - attempt_started, 3),
+                'total_time': round(time.perf_counter() - started, 3),
+                'attempts': attempt,
+                'error': None,
+            }
+        except Exception as e:
+            if attempt > args.retries or not is_retryable(e):
+                return {
+                    'id': question_id,
+                    'question': question,
+                    'answer': None,
+                    'sources': [],
+                    'latency': None,
+                    'total_time': round(time.perf_counter() - started, 3),
+                    'attempts': attempt,
+                    'error': f"{type(e).__name__}: {e}",
+                }
+            # Exponential backoff with full jitter
+            await asyncio.sleep(random.uniform(0, min(60.0, 2 ** attempt)))
+
+
+async def run_batch(args, questions):
+    # Bulk priority behind chat calls; retries stay in answer_question,
+    # which also covers timeouts
+    client = create_client(
+        RateLimiter(args.requests_per_minute, args.tokens_per_minute), BULK, max_retries=0, timeout=args.timeout
+    )
+    store_name = args.store or read_store_name()
+    config = build_config(store_name, args.metadata_filter)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(question_id, question):
+        async with semaphore:
+            return await answer_question(client, args, config, question_id, question)
+
+    started = time.perf_counter()
+    succeeded = 0
+    failed = 0
+    with open(args.output, 'a', encoding='utf-8') as output:
+        tasks = [asyncio.create_task(bounded(question_id, question)) for question_id, question in questions]
+        for done, task in enumerate(asyncio.as_completed(tasks), 1):
+            result = await task
+            # Write each result as soon as it is ready so an interrupted
+            # batch can be resumed
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            if result['error'] is None:
+                succeeded += 1
+            else:
+                failed += 1
+                print(f"❌ {result['id']}: {result['error']}")
+            if done % 50 == 0 or done == len(tasks):
+                elapsed = time.perf_counter() - started
+                print(f"{done}/{len(tasks)} done ({done / elapsed:.2f} questions/s)")
+
+    await client.aio.aclose()
+    return succeeded, failed
+
+
+def main():
+    args = parse_args()
+    questions = read_questions(args.input)
+    finished = read_finished_ids(args.output)
+    pending = [(question_id, question) for question_id, question in questions if question_id not in finished]
+
+    print(f"Questions: {len(questions)}")
+    print(f"Already answered in {args.output}: {len(questions) - len(pending)}")
+    print(f"To answer: {len(pending)} (concurrency {args.concurrency})")
+    if not pending:
+        return
+
+    started = time.perf_counter()
+    succeeded, failed = asyncio.run(run_batch(args, pending))
+    elapsed = time.perf_counter() - started
+
+    print("\n" + "="*60)
+    print(f"Answered: {succeeded}")
+    print(f"Failed: {failed}")
+    print(f"Wall time: {elapsed:.2f}s")
+    print(f"Results written to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import upload_file_search_store
+from fake_gemini import FakeClient, FakeConfig
+from gemini_client import BULK, RateLimitedClient, RateLimiter
+
+WORDS = (
+    "policie", "krajské", "ředitelství", "oznámení", "pátrání", "dopravní", "nehoda",
+    "kriminalita", "prevence", "služebna", "občané", "vyšetřování", "podezřelý", "hlídka",
+    "kontrola", "zpráva", "případ", "senior", "řidič", "obvodní", "oddělení", "svědci",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark upload_file_search_store.py against a local fake of the Gemini API."
+    )
+    parser.add_argument('--sizes', default='100,1000', help="Comma-separated corpus sizes (default: 100,1000)")
+    parser.add_argument('--doc-size', type=int, default=2000, help="Approximate bytes per document (default: 2000)")
+    parser.add_argument('--workers', type=int, default=upload_file_search_store.DEFAULT_WORKERS)
+    parser.add_argument('--max-in-flight', type=int, default=None)
+    parser.add_argument('--poll-rate', type=float, default=50.0, help="Status polls per second (default: 50)")
+    parser.add_argument('--upload-latency', type=float, default=0.05, help="Seconds per fake upload (default: 0.05)")
+    parser.add_argument('--import-delay', type=float, default=2.0, help="Seconds until a fake import finishes (default: 2)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls failing with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Share of calls failing with 429")
+    parser.add_argument('--requests-per-minute', type=int, default=None, help="Request limit of the uploader (default: none)")
+    parser.add_argument('--import-error-rate', type=float, default=0.0, help="Share of imports that fail")
+    parser.add_argument('--no-tracemalloc', action='store_true', help="Do not measure peak Python memory (faster)")
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated corpora")
+    return parser.parse_args()
+
+
+def generate_corpus(root, count, doc_size, seed=0):
+    # Write `count` synthetic articles to root/source_files and a matching
+    # files_metadata.csv. One row in a hundred carries an invalid year.
+    rng = random.Random(seed)
+    source_dir = root / 'source_files'
+    with open(root / 'files_metadata.csv', 'w', encoding='utf-8', newline='') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(['article_filename', 'article_name', 'is_archived', 'is_news', 'article_year'])
+        for i in range(count):
+            year = rng.randint(2005, 2025)
+            stem = f"clanek-{i:06d}"
+            directory = source_dir / str(year)
+            if i == 0 or not directory.exists():
+                directory.mkdir(parents=True, exist_ok=True)
+            words = []
+            length = 0
+            while length < doc_size:
+                word = rng.choice(WORDS)
+                words.append(word)
+                length += len(word) + 1
+            (directory / f"{stem}.md").write_text(
+                f"# Článek {i}\n\n" + " ".join(words), encoding='utf-8'
+            )
+            writer.writerow([
+                stem,
+                f"Článek {i}",
+                rng.choice('01'),
+                rng.choice('01'),
+                'x' if i % 100 == 99 else year,
+            ])
+
+
+def run_upload(client, argv, measure_memory):
+    args = upload_file_search_store.parse_args(argv)
+    client.calls.clear()
+    client.limiter = RateLimiter(args.requests_per_minute)
+    if measure_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        upload_file_search_store.run(client, args)
+    wall_time = time.perf_counter() - started
+    peak = None
+    if measure_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'wall_time': round(wall_time, 3),
+        'api_calls': dict(client.calls),
+        'api_stats': client.stats(),
+        'peak_memory_bytes': peak,
+    }
+
+
+def print_result(label, count, result):
+    calls = ", ".join(f"{method}={n}" for method, n in sorted(result['api_calls'].items()))
+    peak = result['peak_memory_bytes']
+    peak_text = f"{peak / (1024 * 1024):.1f} MiB" if peak is not None else "n/a"
+    print(f"{count:>8} {label:<6} {result['wall_time']:>9.2f}s {count / result['wall_time']:>9.1f} docs/s  peak {peak_text}")
+    print(f"{'':>16} {calls}")
+    stats = result['api_stats']
+    print(f"{'':>16} throttled={stats['throttled']} ({stats['throttled_seconds']:.1f}s), "
+          f"retried={stats['retried']}, rate_limited={stats['rate_limited']}, failed={stats['failed']}")
+
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    argv = ['--workers', str(args.workers), '--poll-rate', str(args.poll_rate)]
+    if args.max_in_flight:
+        argv += ['--max-in-flight', str(args.max_in_flight)]
+    if args.requests_per_minute:
+        argv += ['--requests-per-minute', str(args.requests_per_minute)]
+
+    results = []
+    original_dir = os.getcwd()
+    print(f"{'docs':>8} {'run':<6} {'wall time':>10} {'throughput':>15}")
+    for count in sizes:
+        root = Path(tempfile.mkdtemp(prefix=f'bench-upload-{count}-'))
+        try:
+            generate_corpus(root, count, args.doc_size)
+            # Short backoff, so injected errors do not dominate the timings
+            client = RateLimitedClient(FakeClient(FakeConfig(
+                upload_latency=args.upload_latency,
+                import_delay=args.import_delay,
+                error_rate=args.error_rate,
+                rate_limit_rate=args.rate_limit_rate,
+                import_error_rate=args.import_error_rate,
+            )), priority=BULK, base_delay=0.05)
+            os.chdir(root)
+            # A full upload, then a second run with nothing to do
+            for label in ('cold', 'warm'):
+                result = run_upload(client, argv, not args.no_tracemalloc)
+                result.update({'documents': count, 'run': label})
+                results.append(result)
+                print_result(label, count, result)
+        finally:
+            os.chdir(original_dir)
+            if args.keep:
+                print(f"Corpus kept in {root}")
+            else:
+                shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"\nResults written to: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import json
+import urllib.error
+import urllib.request
+
+
+class SessionNotFound(Exception):
+    """The server no longer knows the session: restarted, deleted or expired."""
+
+
+class ChatApiClient:
+    """Blocking client for chat_server.py, used by the Streamlit thin client."""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=data,
+            method=method,
+            headers={'Content-Type': 'application/json'} if data is not None else {},
+        )
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def create_session(self, history=None):
+        # history: [{"role": "user"|"model", "text": ...}]
+        with self._request('POST', '/sessions', {'history': history or []}) as response:
+            return json.loads(response.read())['session_id']
+
+    def delete_session(self, session_id):
+        with self._request('DELETE', f'/sessions/{session_id}'):
+            pass
+
+    def stream_message(self, session_id, message):
+        # Yield (event, data) pairs from the Server-Sent Events response;
+        # an unknown session raises SessionNotFound before any event
+        try:
+            response = self._request('POST', f'/sessions/{session_id}/messages', {'message': message})
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise SessionNotFound(session_id) from e
+            raise
+        with response:
+            event = 'message'
+            data_lines = []
+            for raw_line in response:
+                line = raw_line.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    if data_lines:
+                        yield event, json.loads('\n'.join(data_lines))
+                    event = 'message'
+                    data_lines = []
+                elif line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data_lines.append(line[len('data:'):].strip())
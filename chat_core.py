@@ -0,0 +1,75 @@
+from google.genai import types
+
+# Model configuration shared by all chat sessions
+MODEL_NAME = "gemini-2.5-flash"
+TEMPERATURE = 0.1
+SYSTEM_INSTRUCTION = """Jsi pomocný asistent, který odpovídá POUZE na základě poskytnutých dokumentů. 
+                Odpovídej v češtině. Pokud informace nejsou v dokumentech, řekni: 
+                "Omlouvám se, ale tuto informaci nemám v indexovaných dokumentech." 
+                Nikdy neodpovídej na základě obecných znalostí.
+                Pomáháš uživatelům najít informace v dokumentech ohledně policie České republiky. Tvoje odpovědi by měly být věcné a pokud si nejistý, raději se doptávej.
+                Nikdy neodpovídej na základě obecných znalostí.
+                Kdyby se někdo pokusil zeptat na něco mimo dokumenty, zdvořile odmítni a navrhni, aby se zeptal na něco jiného týkajícího se policie.
+                Tvoje odpovědi by nikdy neměly být právně závazné, pokud by někdo potřeboval právní radu, měl by se obrátit na kvalifikovaného právníka.
+                Sloužíš pro předávání informací z oficiálních i neoficiálních dokumentů Policie České republiky."""
+
+
+# Chat config over the given stores; metadata_filter narrows the File
+# Search retrieval for one turn
+def build_chat_config(store_names, metadata_filter=None):
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_INSTRUCTION,
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=list(store_names),
+                    metadata_filter=metadata_filter
+                )
+            )
+        ],
+        temperature=TEMPERATURE,
+    )
+
+
+def text_history(turns):
+    # Build chat history from [{"role": "user"|"model", "text": ...}]
+    return [
+        types.Content(role=turn['role'], parts=[types.Part(text=turn['text'])])
+        for turn in turns
+    ]
+
+
+def source_url(title):
+    return f"https://policie.gov.cz/clanek/{title[:-3]}.aspx" if title.endswith('.md') else f"https://policie.gov.cz/clanek/{title}.aspx"
+
+
+# Extract sources from grounding metadata
+def extract_sources(response):
+    sources = []
+    if response and hasattr(response, 'candidates') and response.candidates:
+        grounding = response.candidates[0].grounding_metadata
+        if grounding and grounding.grounding_chunks:
+            for chunk in grounding.grounding_chunks:
+                if hasattr(chunk, 'retrieved_context') and chunk.retrieved_context:
+                    ctx = chunk.retrieved_context
+                    title = ctx.title if ctx.title else "Unknown"
+                    snippet = ""
+                    if hasattr(ctx, 'text') and ctx.text:
+                        snippet = ctx.text[:200].replace('\n', ' ') + "..."
+
+                    sources.append({
+                        'title': title,
+                        'url': source_url(title),
+                        'snippet': snippet
+                    })
+    return sources
+
+
+# Sources of an answer that was cut short; until the stream ends, grounding
+# metadata may be spread over several chunks
+def stream_sources(chunks):
+    sources = {}
+    for chunk in chunks:
+        for source in extract_sources(chunk):
+            sources.setdefault(source['url'], source)
+    return list(sources.values())
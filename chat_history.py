@@ -0,0 +1,76 @@
+from google.genai import types
+
+# Rough size of a token in characters, used to estimate history size
+# without an extra count_tokens call per turn
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Shrň následující konverzaci mezi uživatelem a asistentem do několika vět.
+Zachovej otázky uživatele, fakta z odpovědí, zmíněné dokumenty, roky a jména.
+Nic nepřidávej.
+
+{transcript}"""
+
+SUMMARY_PREFIX = "Shrnutí předchozí části konverzace:"
+
+
+def content_text(content):
+    return "".join(part.text for part in (content.parts or []) if part.text and not part.thought)
+
+
+def estimate_tokens(history):
+    return sum(len(content_text(content)) for content in history) // CHARS_PER_TOKEN
+
+
+def split_turns(history):
+    # Group the history into turns, each starting with a user message
+    turns = []
+    for content in history:
+        if content.role == "user" or not turns:
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def summarize_turns(client, model, turns):
+    transcript = "\n".join(
+        f"{'Uživatel' if content.role == 'user' else 'Asistent'}: {content_text(content)}"
+        for turn in turns for content in turn
+    )
+    response = client.models.generate_content(
+        model=model,
+        contents=SUMMARY_PROMPT.format(transcript=transcript),
+        config=types.GenerateContentConfig(temperature=0.0),
+    )
+    return (response.text or "").strip()
+
+
+def compact_history(client, history, token_budget, keep_turns, summary_model=None):
+    """Shrink a chat history that no longer fits into `token_budget`.
+
+    The last `keep_turns` turns are kept verbatim. Older turns are replaced
+    by a short summary made with `summary_model`, or dropped when no summary
+    model is set or summarizing fails. Returns the new history, or None when
+    the history is within budget.
+    """
+    if estimate_tokens(history) <= token_budget:
+        return None
+    turns = split_turns(history)
+    if len(turns) <= keep_turns:
+        return None
+
+    older = turns[:-keep_turns] if keep_turns else turns
+    recent = [content for turn in turns[len(older):] for content in turn]
+
+    summary = ""
+    if summary_model:
+        try:
+            summary = summarize_turns(client, summary_model, older)
+        except Exception:
+            summary = ""
+    if not summary:
+        return recent
+
+    return [
+        types.Content(role="user", parts=[types.Part(text=f"{SUMMARY_PREFIX}\n{summary}")]),
+        types.Content(role="model", parts=[types.Part(text="Rozumím, budu na konverzaci navazovat.")]),
+    ] + recent
@@ -0,0 +1,280 @@
+import json
+import logging
+import logging.handlers
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Not available on Windows; process_stats then reports only CPU time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Per-turn values summarized as histograms
+HISTOGRAM_FIELDS = (
+    'time_to_first_token', 'total_time', 'chunks',
+    'prompt_tokens', 'output_tokens', 'cached_tokens', 'grounding_chunks',
+)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class TurnMetrics:
+    """Timings and usage of one answered question."""
+
+    def __init__(self, model=None, metadata_filter=None):
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.model = model
+        self.tier = None
+        self.escalated = False
+        self.cost = None
+        self.metadata_filter = metadata_filter
+        self.time_to_first_token = None
+        self.total_time = None
+        self.chunks = 0
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.cached_tokens = None
+        self.grounding_chunks = 0
+        self.retried = False
+        self.cached_answer = False
+        # 'timeout' or 'cancelled' when the answer was cut short
+        self.interrupted = None
+        self.error = None
+
+    def observe(self, stream):
+        # Wrap a send_message_stream iterator and record timings and usage
+        # from the chunks passing through it
+        for chunk in stream:
+            self._record_chunk(chunk)
+            yield chunk
+
+    async def observe_async(self, stream):
+        # Same as observe() for the async client's streams
+        async for chunk in stream:
+            self._record_chunk(chunk)
+            yield chunk
+
+    def _record_chunk(self, chunk):
+        if chunk.text:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self.started
+            self.chunks += 1
+        usage = getattr(chunk, 'usage_metadata', None)
+        if usage:
+            self.prompt_tokens = usage.prompt_token_count
+            self.output_tokens = usage.candidates_token_count
+            self.cached_tokens = usage.cached_content_token_count
+        if chunk.candidates:
+            grounding = chunk.candidates[0].grounding_metadata
+            if grounding and grounding.grounding_chunks:
+                self.grounding_chunks = len(grounding.grounding_chunks)
+
+    def add_cost(self, cost):
+        # Sum of all model calls of the turn, e.g. a fast answer and its
+        # escalation
+        if cost is not None:
+            self.cost = (self.cost or 0.0) + cost
+
+    def finish(self, error=None):
+        self.total_time = time.perf_counter() - self.started
+        self.error = error
+        return self
+
+    def as_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'model': self.model,
+            'tier': self.tier,
+            'escalated': self.escalated,
+            'cost': self.cost,
+            'metadata_filter': self.metadata_filter,
+            'time_to_first_token': self.time_to_first_token,
+            'total_time': self.total_time,
+            'chunks': self.chunks,
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            'grounding_chunks': self.grounding_chunks,
+            'retried': self.retried,
+            'cached_answer': self.cached_answer,
+            'interrupted': self.interrupted,
+            'error': self.error,
+        }
+
+
+class ConversationLog:
+    """Questions with their session and timing, replayed by load_test.py.
+
+    One JSON line per answered question. Only written when a path is
+    configured, since it keeps what users typed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, session_id, question, turn):
+        line = json.dumps({
+            'session': session_id,
+            'timestamp': turn.timestamp,
+            'question': question,
+            'time_to_first_token': turn.time_to_first_token,
+            'total_time': turn.total_time,
+            'cached_answer': turn.cached_answer,
+            'interrupted': turn.interrupted,
+            'error': turn.error,
+        }, ensure_ascii=False)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+def process_stats():
+    # CPU seconds and resident memory (current and peak) of this process
+    if resource is None:
+        return {'cpu_seconds': time.process_time(), 'rss_bytes': None, 'max_rss_bytes': None}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with open('/proc/self/statm') as f:
+            rss_bytes = int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        rss_bytes = None
+    return {
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'rss_bytes': rss_bytes,
+        # Kilobytes on Linux
+        'max_rss_bytes': usage.ru_maxrss * 1024,
+    }
+
+
+def quantile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # Nearest-rank quantile
+    index = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class MetricsRecorder:
+    """Process-wide store of recent turns.
+
+    Keeps the last `window` turns in memory for p50/p95/p99 summaries and
+    appends every turn to a size-rotated JSONL log when `log_path` is set.
+    `api_stats` returns the Gemini call counters of a RateLimitedClient.
+    """
+
+    def __init__(self, window=1000, log_path=None, max_bytes=10 * 1024 * 1024, backup_count=5, api_stats=None):
+        self._turns = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.total_turns = 0
+        self.errors = 0
+        self.api_stats = api_stats
+        self._server = None
+
+        self._log = None
+        if log_path:
+            self._log = logging.getLogger(f"mvcr_ai.metrics.{log_path}")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._log.addHandler(handler)
+
+    def record(self, turn):
+        data = turn.as_dict()
+        with self._lock:
+            self._turns.append(data)
+            self.total_turns += 1
+            if turn.error:
+                self.errors += 1
+        if self._log:
+            self._log.info(json.dumps(data, ensure_ascii=False))
+
+    def summary(self):
+        with self._lock:
+            turns = list(self._turns)
+            total_turns, errors = self.total_turns, self.errors
+        summary = {'turns': total_turns, 'errors': errors, 'window': len(turns)}
+        # Answers cut short among the recent turns
+        for interrupted in ('timeout', 'cancelled'):
+            summary[interrupted] = sum(1 for turn in turns if turn.get('interrupted') == interrupted)
+        for field in HISTOGRAM_FIELDS:
+            values = sorted(turn[field] for turn in turns if turn[field] is not None)
+            summary[field] = {f"p{int(q * 100)}": quantile(values, q) for q in QUANTILES}
+        summary['tiers'] = {}
+        for tier in sorted({turn['tier'] for turn in turns if turn.get('tier')}):
+            tier_turns = [turn for turn in turns if turn.get('tier') == tier]
+            tier_summary = {
+                'turns': len(tier_turns),
+                'escalated': sum(1 for turn in tier_turns if turn['escalated']),
+                'cost': sum(turn['cost'] for turn in tier_turns if turn['cost'] is not None),
+            }
+            for field in ('time_to_first_token', 'total_time'):
+                values = sorted(turn[field] for turn in tier_turns if turn[field] is not None)
+                tier_summary[field] = {f"p{int(q * 100)}": quantile(values, q) for q in QUANTILES}
+            summary['tiers'][tier] = tier_summary
+        if self.api_stats:
+            summary['api'] = self.api_stats()
+        return summary
+
+    def prometheus(self):
+        # Render the summary in the Prometheus text exposition format
+        summary = self.summary()
+        lines = [
+            f"mvcr_chat_turns_total {summary['turns']}",
+            f"mvcr_chat_errors_total {summary['errors']}",
+            f'mvcr_chat_interrupted{{reason="timeout"}} {summary["timeout"]}',
+            f'mvcr_chat_interrupted{{reason="cancelled"}} {summary["cancelled"]}',
+        ]
+        for field in HISTOGRAM_FIELDS:
+            lines.append(f"# TYPE mvcr_chat_{field} summary")
+            for q in QUANTILES:
+                value = summary[field][f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f'mvcr_chat_{field}{{quantile="{q}"}} {value}')
+        for tier, tier_summary in summary['tiers'].items():
+            lines.append(f'mvcr_chat_tier_turns{{tier="{tier}"}} {tier_summary["turns"]}')
+            lines.append(f'mvcr_chat_tier_escalated{{tier="{tier}"}} {tier_summary["escalated"]}')
+            lines.append(f'mvcr_chat_tier_cost_usd{{tier="{tier}"}} {tier_summary["cost"]}')
+            for field in ('time_to_first_token', 'total_time'):
+                for q in QUANTILES:
+                    value = tier_summary[field][f"p{int(q * 100)}"]
+                    if value is not None:
+                        lines.append(f'mvcr_chat_tier_{field}{{tier="{tier}",quantile="{q}"}} {value}')
+        for name, value in summary.get('api', {}).items():
+            lines.append(f"mvcr_gemini_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host='127.0.0.1'):
+        # Expose /metrics (Prometheus text) and /metrics.json on a local port
+        if self._server is not None:
+            return
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = recorder.prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(recorder.summary()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
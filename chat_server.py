@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+
+from aiohttp import web
+from google import genai
+from google.genai import errors
+
+from chat_core import MODEL_NAME, build_chat_config, extract_sources, stream_sources, text_history
+from chat_history import compact_history, estimate_tokens
+from chat_metrics import ConversationLog, MetricsRecorder, TurnMetrics, process_stats
+from context_cache import ContextCache
+from gemini_client import RateLimitedClient, RateLimiter
+from llm import read_store_name
+from model_tiers import FAST_MODEL, choose_tier, needs_escalation, turn_cost
+from query_router import Route, route_question
+from session_store import SESSION_DB, SessionPool, SessionStore, history_turns
+from store_partitions import StorePartitions
+from stream_deadline import ActiveTurns, AnswerCancelled, AnswerTimeout, Deadline
+
+logger = logging.getLogger("mvcr_ai.server")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the MVCR chat over HTTP with Server-Sent Events."
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument(
+        '--store', default=os.environ.get('FILE_SEARCH_STORE_NAME'),
+        help="File Search store name (default: $FILE_SEARCH_STORE_NAME or file_search_store_name.txt)"
+    )
+    parser.add_argument(
+        '--partitions', default=os.environ.get('FILE_SEARCH_PARTITIONS'),
+        help="Partitioned store layout (file_search_stores.json) used instead of --store"
+    )
+    parser.add_argument('--history-token-budget', type=int, default=6000)
+    parser.add_argument('--history-keep-turns', type=int, default=3)
+    parser.add_argument('--history-summary-model', default='gemini-2.5-flash-lite',
+                        help="Model summarizing old turns; empty drops them instead")
+    parser.add_argument('--router-model', default='gemini-2.5-flash-lite',
+                        help="Model resolving unclear time constraints; empty uses rules only")
+    parser.add_argument('--fast-model', default=FAST_MODEL,
+                        help="Model for simple and refusal-class questions; empty uses the main model only")
+    parser.add_argument('--include-archive', action='store_true',
+                        help="Do not exclude archived articles by default")
+    parser.add_argument(
+        '--requests-per-minute', type=int, default=int(os.environ.get('GEMINI_RPM', 0)) or None,
+        help="Gemini requests per minute (default: $GEMINI_RPM or no limit)"
+    )
+    parser.add_argument(
+        '--tokens-per-minute', type=int, default=int(os.environ.get('GEMINI_TPM', 0)) or None,
+        help="Gemini tokens per minute (default: $GEMINI_TPM or no limit)"
+    )
+    parser.add_argument('--first-token-timeout', type=float, default=30.0,
+                        help="Seconds a model call may take to its first text, 0 for no limit (default: 30)")
+    parser.add_argument('--answer-timeout', type=float, default=120.0,
+                        help="Seconds an answer may take in total, 0 for no limit; text streamed by then "
+                             "is kept as a partial answer (default: 120)")
+    parser.add_argument('--context-cache-ttl', type=int, default=3600,
+                        help="Seconds the system instruction and File Search config stay cached on the Gemini "
+                             "side, 0 to send them with every turn (default: 3600)")
+    parser.add_argument('--metrics-log', default='chat_metrics.jsonl')
+    parser.add_argument('--session-db', default=SESSION_DB)
+    parser.add_argument('--session-idle-ttl', type=int, default=1800,
+                        help="Seconds before an idle session is dropped from memory")
+    parser.add_argument('--session-memory-tokens', type=int, default=2_000_000,
+                        help="Estimated tokens of all in-memory histories before the least recently used are dropped")
+    parser.add_argument('--conversation-log', default='',
+                        help="Append questions with their timing to this JSONL file for load_test.py (default: off)")
+    return parser.parse_args(argv)
+
+
+class ChatSession:
+    def __init__(self, chat):
+        self.chat = chat
+        # One answer at a time per conversation
+        self.lock = asyncio.Lock()
+
+
+class ChatService:
+    """Chat sessions backed by the async Gemini client.
+
+    All sessions share one `genai.Client`, and with it one connection pool.
+    The turn logic mirrors streamlit_app.py: model tiering with escalation,
+    metadata filter routing with a retry without the filter, deadlines with
+    a partial-answer fallback, and history compaction after each turn. A
+    newer message to a session cancels the answer still streaming in it.
+    Messages are saved to the SessionStore, so sessions evicted from the
+    SessionPool are rebuilt on their next message.
+    """
+
+    def __init__(self, client, store_names, args, metrics, session_store, partitions=None):
+        self.client = client
+        self.context_cache = ContextCache(client, ttl=args.context_cache_ttl)
+        self.conversation_log = ConversationLog(args.conversation_log) if args.conversation_log else None
+        self.store_names = tuple(store_names)
+        self.partitions = partitions
+        self.args = args
+        self.metrics = metrics
+        self.session_store = session_store
+        self.sessions = SessionPool(idle_ttl=args.session_idle_ttl, max_tokens=args.session_memory_tokens)
+        self.active_turns = ActiveTurns()
+
+    def create_chat(self, history=None, model=MODEL_NAME):
+        return self.client.aio.chats.create(
+            model=model,
+            config=build_chat_config(self.store_names),
+            history=history,
+        )
+
+    def create_session(self, turns=()):
+        # turns: [{"role": "user"|"model", "text": ...}]
+        session_id = self.session_store.create_session()
+        for turn in turns:
+            role = "assistant" if turn['role'] == "model" else turn['role']
+            self.session_store.add_message(session_id, role, turn['text'])
+        history = text_history(turns)
+        self.sessions.put(session_id, ChatSession(self.create_chat(history)), estimate_tokens(history))
+        return session_id
+
+    async def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None and await asyncio.to_thread(self.session_store.exists, session_id):
+            messages = await asyncio.to_thread(self.session_store.messages, session_id)
+            history = text_history(history_turns(messages))
+            session = ChatSession(self.create_chat(history))
+            self.sessions.put(session_id, session, estimate_tokens(history))
+            # Compacts the rebuilt history if it is over the budget
+            await self.manage_history(session_id, session)
+        return session
+
+    def answer_deadline(self, session_id, ticket, started):
+        return Deadline(
+            self.args.first_token_timeout or None, self.args.answer_timeout or None,
+            lambda: self.active_turns.superseded(session_id, ticket), started
+        )
+
+    def delete_session(self, session_id):
+        self.sessions.discard(session_id)
+        self.session_store.delete(session_id)
+
+    async def answer(self, session_id, session, prompt):
+        """Yield (event, data) pairs for one message, as post_message sends them.
+
+        Cancels the answer still streaming in the session, waits for it to
+        release the session, saves the finished turn and records its
+        metrics. Failures end with an `error` event; a caller that stops
+        reading is recorded as a client disconnect.
+        """
+        # Cancels the answer still streaming in this session, which then
+        # releases the lock
+        ticket = self.active_turns.start(session_id)
+        async with session.lock:
+            metrics = TurnMetrics(model=MODEL_NAME)
+            deadline = self.answer_deadline(session_id, ticket, metrics.started)
+            try:
+                if self.active_turns.superseded(session_id, ticket):
+                    # A newer message arrived while this one waited for the lock
+                    metrics.interrupted = 'cancelled'
+                    raise AnswerCancelled("A newer question replaced this answer")
+                async for event, data in self.stream_answer(session_id, session, prompt, metrics, deadline):
+                    if event == 'done':
+                        data['metrics'] = metrics.finish().as_dict()
+                        await asyncio.to_thread(save_turn, self.session_store, session_id, prompt, data)
+                    yield event, data
+                self.metrics.record(metrics)
+                logger.info(
+                    "Answered in %.2fs on %s: prompt tokens %s (cached %s), output tokens %s",
+                    metrics.total_time, metrics.model, metrics.prompt_tokens, metrics.cached_tokens or 0,
+                    metrics.output_tokens
+                )
+                if self.conversation_log:
+                    await asyncio.to_thread(self.conversation_log.record, session_id, prompt, metrics)
+            except (GeneratorExit, asyncio.CancelledError):
+                # The client went away; the partial turn is not recorded
+                self.metrics.record(metrics.finish(error="client disconnected"))
+                raise
+            except (AnswerTimeout, AnswerCancelled) as e:
+                logger.info("Answer interrupted: %s", e)
+                self.metrics.record(metrics.finish(error=str(e)))
+                yield 'error', {'message': str(e), 'interrupted': metrics.interrupted}
+            except Exception as e:
+                logger.exception("Answer failed")
+                self.metrics.record(metrics.finish(error=str(e)))
+                yield 'error', {'message': str(e)}
+            finally:
+                self.active_turns.finish(session_id)
+
+    async def stream_answer(self, session_id, session, prompt, metrics, deadline):
+        """Yield (event, data) pairs for one answer.
+
+        `chunk` events carry text, `reset` tells the client to discard the
+        text streamed so far (the question is asked again without the
+        metadata filter or on the stronger model), and `done` carries the
+        full answer and sources. An answer cut off by the total deadline
+        ends with a `done` event for the text streamed so far, marked
+        `interrupted`; without any text, AnswerTimeout is raised.
+        """
+        history = session.chat.get_history(curated=True)
+        tier = choose_tier(prompt, self.args.fast_model)
+        metrics.tier = tier.name
+        # Every turn is asked on its own tier's model
+        session.chat = self.create_chat(history, tier.model)
+
+        exclude_archive = not self.args.include_archive
+        if tier.name == 'refusal':
+            # No routing call, but the archive stays excluded
+            route = Route()
+        elif self.args.router_model:
+            route = await asyncio.to_thread(route_question, prompt, self.client, self.args.router_model)
+        else:
+            route = route_question(prompt)
+        metadata_filter = route.metadata_filter(exclude_archive=exclude_archive)
+        store_names = tuple(self.partitions.select(route, exclude_archive)) if self.partitions else self.store_names
+        metrics.metadata_filter = metadata_filter
+        narrowed = route.narrowed
+
+        config = self.context_cache.config(tier.model, store_names, metadata_filter)
+        turn = {'parts': [], 'chunks': [], 'response': None}
+        try:
+            async for event in self.stream_turn(session, prompt, metrics, tier.model, config, turn, deadline):
+                yield event
+
+            sources = extract_sources(turn['response'])
+            retry = narrowed and not sources
+            escalate = tier.escalate and needs_escalation(turn['response'], ''.join(turn['parts']), sources)
+            if retry or escalate:
+                # Drop this turn from the history and ask again: without the
+                # year and news constraints (archived articles stay excluded)
+                # when nothing matched them, on the stronger model when the
+                # fast answer was weak
+                if retry:
+                    logger.info("No grounding with metadata_filter=%r, retrying without the year and news constraints",
+                                metadata_filter)
+                    metrics.retried = True
+                    route = route.widened()
+                    metadata_filter = route.metadata_filter(exclude_archive=exclude_archive)
+                    store_names = (
+                        tuple(self.partitions.select(route, exclude_archive)) if self.partitions else self.store_names
+                    )
+                if escalate:
+                    logger.info("Weak answer from %s, escalating to %s", tier.model, MODEL_NAME)
+                    metrics.escalated = True
+                model = MODEL_NAME if escalate else tier.model
+                session.chat = self.create_chat(history, model)
+                config = self.context_cache.config(model, store_names, metadata_filter)
+                yield 'reset', {}
+                turn = {'parts': [], 'chunks': [], 'response': None}
+                async for event in self.stream_turn(session, prompt, metrics, model, config, turn, deadline):
+                    yield event
+        except (AnswerTimeout, AnswerCancelled) as e:
+            # The chat only records finished answers. It goes on without this
+            # turn, or with the partial answer after a timeout, which is
+            # also what gets saved.
+            metrics.interrupted = 'timeout' if isinstance(e, AnswerTimeout) else 'cancelled'
+            text = ''.join(turn['parts'])
+            if metrics.interrupted == 'cancelled' or not text:
+                session.chat = self.create_chat(history)
+                raise
+            logger.warning("%s, keeping %d characters of the answer", e, len(text))
+            session.chat = self.create_chat(history + text_history([
+                {'role': 'user', 'text': prompt},
+                {'role': 'model', 'text': text},
+            ]))
+            await self.manage_history(session_id, session)
+            yield 'done', {'text': text, 'sources': stream_sources(turn['chunks']), 'interrupted': 'timeout'}
+            return
+
+        await self.manage_history(session_id, session)
+        yield 'done', {'text': ''.join(turn['parts']), 'sources': extract_sources(turn['response'])}
+
+    async def stream_turn(self, session, prompt, metrics, model, config, turn, deadline):
+        # Yield `chunk` events for one model response; its text parts and
+        # chunks are collected in turn
+        metrics.prompt_tokens = metrics.output_tokens = metrics.cached_tokens = None
+        metrics.model = model
+        stream = deadline.iterate_async(session.chat.send_message_stream(prompt, config=config))
+        try:
+            async for chunk in metrics.observe_async(stream):
+                turn['chunks'].append(chunk)
+                turn['response'] = chunk
+                if chunk.text:
+                    turn['parts'].append(chunk.text)
+                    yield 'chunk', {'text': chunk.text}
+        except errors.ClientError as e:
+            full_config = None if turn['chunks'] else self.context_cache.reject(config, e)
+            if full_config is None:
+                raise
+            async for event in self.stream_turn(session, prompt, metrics, model, full_config, turn, deadline):
+                yield event
+        finally:
+            metrics.add_cost(turn_cost(model, metrics.prompt_tokens, metrics.output_tokens, metrics.cached_tokens))
+
+    async def manage_history(self, session_id, session):
+        history = session.chat.get_history(curated=True)
+        compacted = await asyncio.to_thread(
+            compact_history, self.client, history,
+            self.args.history_token_budget, self.args.history_keep_turns,
+            self.args.history_summary_model or None
+        )
+        if compacted is not None:
+            session.chat = self.create_chat(compacted)
+            logger.info(
+                "Compacted history from ~%d to ~%d tokens",
+                estimate_tokens(history), estimate_tokens(compacted)
+            )
+            history = compacted
+        self.sessions.put(session_id, session, estimate_tokens(history))
+
+
+def save_turn(session_store, session_id, prompt, answer):
+    session_store.add_message(session_id, "user", prompt)
+    session_store.add_message(session_id, "assistant", answer['text'], answer['sources'])
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+async def create_session(request):
+    service = request.app['service']
+    body = await request.json() if request.body_exists else {}
+    session_id = await asyncio.to_thread(service.create_session, body.get('history', []))
+    return web.json_response({'session_id': session_id}, status=201)
+
+
+async def delete_session(request):
+    service = request.app['service']
+    await asyncio.to_thread(service.delete_session, request.match_info['session_id'])
+    return web.Response(status=204)
+
+
+async def post_message(request):
+    service = request.app['service']
+    session_id = request.match_info['session_id']
+    session = await service.get_session(session_id)
+    if session is None:
+        raise web.HTTPNotFound(text="Unknown session")
+    body = await request.json()
+    prompt = (body.get('message') or '').strip()
+    if not prompt:
+        raise web.HTTPBadRequest(text="Missing message")
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+
+    # A write failing because the client went away closes the answer
+    async with contextlib.aclosing(service.answer(session_id, session, prompt)) as events:
+        async for event, data in events:
+            await response.write(sse_event(event, data))
+
+    await response.write_eof()
+    return response
+
+
+async def health(request):
+    service = request.app['service']
+    return web.json_response({
+        'status': 'ok',
+        'sessions': len(service.sessions),
+        'api': service.client.stats(),
+        'context_cache': service.context_cache.stats(),
+        'process': process_stats(),
+    })
+
+
+async def metrics_text(request):
+    return web.Response(text=request.app['service'].metrics.prometheus(), content_type='text/plain')
+
+
+async def metrics_json(request):
+    return web.json_response(request.app['service'].metrics.summary())
+
+
+def create_app(service):
+    app = web.Application()
+    app['service'] = service
+    app.router.add_post('/sessions', create_session)
+    app.router.add_delete('/sessions/{session_id}', delete_session)
+    app.router.add_post('/sessions/{session_id}/messages', post_message)
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics_text)
+    app.router.add_get('/metrics.json', metrics_json)
+
+    async def close_client(app):
+        await service.client.aio.aclose()
+
+    app.on_cleanup.append(close_client)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args = parse_args()
+    partitions = StorePartitions.load(args.partitions) if args.partitions else None
+    store_names = partitions.store_names() if partitions else [args.store or read_store_name()]
+
+    # Reads GEMINI_API_KEY from the environment
+    client = RateLimitedClient(genai.Client(), RateLimiter(args.requests_per_minute, args.tokens_per_minute))
+    metrics = MetricsRecorder(log_path=args.metrics_log or None, api_stats=client.stats)
+    service = ChatService(client, store_names, args, metrics, SessionStore(args.session_db), partitions)
+
+    print(f"Serving chat for File Search stores {', '.join(store_names)} on http://{args.host}:{args.port}")
+    web.run_app(create_app(service), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from google.genai import errors, types
+
+from chat_core import build_chat_config
+
+logger = logging.getLogger("mvcr_ai.context_cache")
+
+
+class _Entry:
+    def __init__(self, full_config):
+        self.full_config = full_config
+        self.name = None
+        self.expires_at = 0.0
+        self.tokens = None
+        self.pending = False
+        # No new attempt before this time after a transient failure
+        self.failed_until = 0.0
+
+
+class ContextCache:
+    """Gemini cached-content entries for the fixed prefix of chat requests.
+
+    The system instruction and the File Search tool config are the same on
+    every turn of every session, so they are stored once per model and tool
+    config and referenced by name instead of being sent again. Entries are
+    created and refreshed in a background thread: a turn uses an entry
+    only while it has at least `min_remaining` seconds left, and one used
+    within `refresh_margin` seconds of its expiry gets its TTL extended.
+    Entries for a changed instruction or store list get a new key, so they
+    are created anew while the old ones expire.
+
+    Whenever there is no usable entry (caching is off, the model does not
+    support it, the prefix is below the minimum size, or the call failed)
+    turns get the full config from build_chat_config. A 4xx from creating
+    an entry turns caching off for that model for the life of the process,
+    so rotating metadata filters do not repeat a create that cannot
+    succeed. `ttl` 0 disables caching.
+    """
+
+    def __init__(self, client, ttl=3600, refresh_margin=600, min_remaining=60, retry_interval=600, max_entries=16):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_remaining = min_remaining
+        self.retry_interval = retry_interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (model, config fingerprint) -> _Entry
+        self._unsupported = set()  # models whose entries cannot be created
+        self._lock = threading.Lock()
+        self.counters = {'created': 0, 'refreshed': 0, 'failed': 0, 'hits': 0, 'misses': 0}
+
+    def config(self, model, store_names, metadata_filter=None):
+        # GenerateContentConfig for one turn on `model`; never waits for the
+        # cache API, so it can be called from the event loop
+        full_config = build_chat_config(store_names, metadata_filter)
+        if not self.ttl or model in self._unsupported:
+            return full_config
+        key = (model, hashlib.sha256(full_config.model_dump_json(exclude_none=True).encode('utf-8')).hexdigest())
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(full_config)
+                self._evict()
+            self._entries.move_to_end(key)
+            remaining = entry.expires_at - now
+            usable = entry.name is not None and remaining > self.min_remaining
+            if not entry.pending and entry.failed_until <= now and (not usable or remaining < self.refresh_margin):
+                entry.pending = True
+                threading.Thread(
+                    target=self._update, args=(key, entry, model, full_config, usable),
+                    name='context-cache', daemon=True
+                ).start()
+            self.counters['hits' if usable else 'misses'] += 1
+            name = entry.name if usable else None
+        if name is None:
+            return full_config
+        return types.GenerateContentConfig(cached_content=name, temperature=full_config.temperature)
+
+    def reject(self, config, error):
+        # Full config to ask again with when a turn failed on its cached
+        # content (expired, deleted, or not accepted with this request), or
+        # None when the failure has nothing to do with the cache. The entry
+        # is not used until it is created again.
+        name = getattr(config, 'cached_content', None)
+        if not name or not isinstance(error, errors.ClientError) or getattr(error, 'code', None) == 429:
+            return None
+        with self._lock:
+            entry = next((entry for entry in self._entries.values() if entry.name == name), None)
+            if entry is None:
+                return None
+            entry.name = None
+            entry.failed_until = time.time() + self.retry_interval
+            self.counters['failed'] += 1
+        logger.warning("Turn failed on cached content %s, asking again with the full prefix: %s", name, error)
+        return entry.full_config
+
+    def _update(self, key, entry, model, full_config, refresh):
+        try:
+            if refresh:
+                try:
+                    cached = self.client.caches.update(
+                        name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                    )
+                    counter = 'refreshed'
+                except errors.APIError as e:
+                    # Gone already; create a new one below
+                    logger.info("Could not refresh cached content %s: %s", entry.name, e)
+                    refresh = False
+            if not refresh:
+                cached = self.client.caches.create(model=model, config=types.CreateCachedContentConfig(
+                    display_name='mvcr-chat-prefix',
+                    system_instruction=full_config.system_instruction,
+                    tools=full_config.tools,
+                    ttl=f"{self.ttl}s",
+                ))
+                counter = 'created'
+        except Exception as e:
+            # 4xx errors (prefix below the minimum, model without caching)
+            # will not go away for this model, whatever the tool config
+            permanent = isinstance(e, errors.ClientError) and getattr(e, 'code', None) != 429
+            logger.warning(
+                "Context caching unavailable for %s%s, sending the full prefix: %s",
+                model, " until restart" if permanent else f" (next attempt in {self.retry_interval}s)", e
+            )
+            with self._lock:
+                self.counters['failed'] += 1
+                entry.name = None
+                entry.failed_until = time.time() + self.retry_interval
+                entry.pending = False
+                if permanent:
+                    self._unsupported.add(model)
+                    for key in [key for key in self._entries if key[0] == model]:
+                        removed = self._entries.pop(key)
+                        if removed.name:
+                            threading.Thread(target=self._delete, args=(removed.name,), daemon=True).start()
+            return
+
+        expires_at = cached.expire_time.timestamp() if cached.expire_time else time.time() + self.ttl
+        tokens = cached.usage_metadata.total_token_count if cached.usage_metadata else entry.tokens
+        with self._lock:
+            self.counters[counter] += 1
+            entry.name = cached.name
+            entry.expires_at = expires_at
+            entry.tokens = tokens
+            entry.pending = False
+            evicted = key not in self._entries
+        if counter == 'created':
+            logger.info("Cached the chat prefix for %s as %s (%s tokens)", model, cached.name, tokens)
+        if evicted:
+            self._delete(cached.name)
+
+    def _evict(self):
+        # Called with the lock held; the least recently used entries are
+        # deleted from the API as well
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            if entry.name:
+                threading.Thread(target=self._delete, args=(entry.name,), daemon=True).start()
+
+    def _delete(self, name):
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            logger.info("Could not delete cached content %s: %s", name, e)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = sum(
+                1 for entry in self._entries.values() if entry.name and entry.expires_at > now
+            )
+            stats['unsupported'] = sorted(self._unsupported)
+        return stats
@@ -0,0 +1,241 @@
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sync_manifest import SOURCE_EXTENSIONS, hash_file, scan_source_files, write_if_changed
+
+# Optional converters: pip install pypdf python-docx; .doc needs antiword
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    import docx
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+except ImportError:
+    docx = None
+
+# source_files with PDF/DOC/DOCX replaced by Markdown where possible
+CONVERTED_DIR = Path('converted_files')
+
+# Converted text by content hash, shared between runs
+CONVERSION_CACHE_DIR = Path('.conversion_cache')
+
+# Bump when the extraction changes, so cached results are redone
+CONVERTER_VERSION = 1
+
+# Extracted text with fewer letters and digits than this (e.g. a scanned
+# PDF without a text layer) is not usable and the original is uploaded
+MIN_TEXT_CHARS = 200
+
+ALNUM_PATTERN = re.compile(r'[^\W_]')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert PDF/DOC/DOCX in source_files to Markdown before upload."
+    )
+    parser.add_argument('--source-dir', type=Path, default=Path('source_files'))
+    parser.add_argument('--output-dir', type=Path, default=CONVERTED_DIR)
+    parser.add_argument('--cache-dir', type=Path, default=CONVERSION_CACHE_DIR)
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 1,
+        help="Number of worker processes (default: number of CPUs)"
+    )
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def available_converters():
+    return {
+        '.pdf': pypdf is not None,
+        '.docx': docx is not None,
+        '.doc': shutil.which('antiword') is not None,
+    }
+
+
+def pdf_to_markdown(file_path):
+    reader = pypdf.PdfReader(file_path)
+    pages = [(page.extract_text() or '').strip() for page in reader.pages]
+    return '\n\n'.join(page for page in pages if page)
+
+
+def docx_to_markdown(file_path):
+    document = docx.Document(file_path)
+    blocks = []
+    # Walk the body in order so tables stay between their paragraphs
+    for child in document.element.body.iterchildren():
+        tag = child.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            paragraph = Paragraph(child, document)
+            text = paragraph.text.strip()
+            if not text:
+                continue
+            style = paragraph.style.name if paragraph.style is not None else ''
+            level = re.search(r'\d+', style)
+            if style == 'Title':
+                blocks.append(f"# {text}")
+            elif style.startswith('Heading'):
+                blocks.append(f"{'#' * min(int(level.group()) if level else 1, 6)} {text}")
+            elif style.startswith('List'):
+                blocks.append(f"- {text}")
+            else:
+                blocks.append(text)
+        elif tag == 'tbl':
+            table = Table(child, document)
+            rows = [
+                [' '.join(cell.text.split()).replace('|', '\\|') for cell in row.cells]
+                for row in table.rows
+            ]
+            if rows:
+                lines = [f"| {' | '.join(rows[0])} |", f"|{'---|' * len(rows[0])}"]
+                lines.extend(f"| {' | '.join(row)} |" for row in rows[1:])
+                blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def doc_to_markdown(file_path):
+    result = subprocess.run(
+        ['antiword', '-w', '0', str(file_path)],
+        capture_output=True, timeout=120, check=True
+    )
+    return result.stdout.decode('utf-8', errors='replace')
+
+
+CONVERTERS = {
+    '.pdf': pdf_to_markdown,
+    '.docx': docx_to_markdown,
+    '.doc': doc_to_markdown,
+}
+
+
+def is_usable(text):
+    if len(ALNUM_PATTERN.findall(text)) < MIN_TEXT_CHARS:
+        return False
+    # Mostly undecodable characters means a broken text layer
+    return text.count('\ufffd') < len(text) * 0.05
+
+
+def convert_file(item):
+    # Worker: convert one file through the cache. Returns (relative,
+    # Markdown text or None, whether it came from the cache, error).
+    relative, file_path, cache_dir = item
+    suffix = file_path.suffix.lower()
+    cache_key = f"{hash_file(file_path)}-v{CONVERTER_VERSION}"
+    cached_text = cache_dir / f"{cache_key}.md"
+    cached_unusable = cache_dir / f"{cache_key}.unusable"
+    if cached_text.exists():
+        return relative, cached_text.read_text(encoding='utf-8'), True, None
+    if cached_unusable.exists():
+        return relative, None, True, None
+
+    try:
+        text = re.sub(r'\n{3,}', '\n\n', CONVERTERS[suffix](file_path)).strip() + '\n'
+    except Exception as e:
+        # Failures are not cached, so a fixed converter picks them up again
+        return relative, None, False, f"{type(e).__name__}: {e}"
+
+    usable = is_usable(text)
+    target = cached_text if usable else cached_unusable
+    temporary = target.with_suffix(f'.{os.getpid()}.tmp')
+    temporary.write_text(text if usable else '', encoding='utf-8')
+    temporary.replace(target)
+    return relative, text if usable else None, False, None
+
+
+def link_if_changed(source, target):
+    # Hard link unchanged files into the output tree, copying across devices
+    if target.exists():
+        if os.path.samefile(source, target):
+            return False
+        target.unlink()
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return True
+
+
+def convert(source_dir, output_dir, workers, cache_dir=CONVERSION_CACHE_DIR):
+    # Mirror source_dir into output_dir, replacing each PDF/DOC/DOCX with
+    # `<name>.<ext>.md` when its text is usable. Other files, and binaries
+    # that cannot be converted, are linked unchanged.
+    started = time.perf_counter()
+    source_dir, output_dir, cache_dir = Path(source_dir), Path(output_dir), Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    scanned = scan_source_files(source_dir, SOURCE_EXTENSIONS)
+    converters = available_converters()
+    jobs = [
+        (relative, file_path, cache_dir) for relative, (file_path, _, _) in scanned.items()
+        if converters.get(file_path.suffix.lower())
+    ]
+    missing = sorted(suffix for suffix, available in converters.items() if not available)
+    print(f"Converting {len(jobs)} documents from {source_dir} with {workers} workers...")
+    if missing:
+        print(f"No converter for {', '.join(missing)}; these files are uploaded as they are")
+
+    converted = {}
+    from_cache = 0
+    failed = []
+    unusable = 0
+    if jobs:
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for relative, text, cached, error in executor.map(convert_file, jobs, chunksize=chunksize):
+                from_cache += cached
+                if error:
+                    failed.append((relative, error))
+                elif text is None:
+                    unusable += 1
+                else:
+                    converted[relative] = text
+
+    written = 0
+    original_bytes = 0
+    output_bytes = 0
+    expected = set()
+    for relative, (file_path, size, _) in scanned.items():
+        if relative in converted:
+            data = converted[relative].encode('utf-8')
+            target = f"{relative}.md"
+            written += write_if_changed(output_dir / target, data)
+            original_bytes += size
+            output_bytes += len(data)
+        else:
+            target = relative
+            written += link_if_changed(file_path, output_dir / target)
+        expected.add(target)
+    removed = 0
+    for relative, (file_path, _, _) in scan_source_files(output_dir, SOURCE_EXTENSIONS).items():
+        if relative not in expected:
+            file_path.unlink()
+            removed += 1
+
+    print(f"Converted to Markdown: {len(converted)} ({from_cache} from cache)")
+    print(f"Kept as original: {unusable} without usable text, {len(failed)} failed")
+    for relative, error in failed:
+        print(f"  - {relative}: {error}")
+    if converted:
+        print(f"Converted size: {original_bytes / 1024:.0f} KiB -> {output_bytes / 1024:.0f} KiB")
+    print(f"Written: {written}, removed from {output_dir}: {removed}")
+    print(f"Finished in {time.perf_counter() - started:.1f}s")
+    return converted
+
+
+def main():
+    args = parse_args()
+    convert(args.source_dir, args.output_dir, args.workers, args.cache_dir)
+
+
+if __name__ == '__main__':
+    main()
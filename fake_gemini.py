@@ -0,0 +1,340 @@
+"""Local stand-in for the parts of the Gemini API used by this repo.
+
+Used by the benchmarks to exercise the upload and chat paths without
+spending quota. Latencies, import delays, streaming speed and error rates
+are configurable, and every call is counted.
+"""
+import asyncio
+import datetime
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+
+from google.genai import errors, types
+
+
+ANSWER_WORDS = (
+    "Policie", "České", "republiky", "podle", "dostupných", "dokumentů", "uvádí", "že",
+    "krajské", "ředitelství", "v", "roce", "zajistilo", "kontroly", "a", "preventivní",
+    "akce", "pro", "občany", "oddělení", "informuje", "o", "případu", "na", "svém", "webu",
+)
+
+# Prompt tokens of the system instruction and tool config in every answer
+PREFIX_TOKENS = 2000
+
+
+class FakeConfig:
+    def __init__(self, upload_latency=0.05, import_delay=2.0, error_rate=0.0,
+                 rate_limit_rate=0.0, import_error_rate=0.0, seed=0,
+                 first_token_delay=0.8, chunk_delay=0.05, answer_chunks=20, generate_latency=0.3,
+                 cache_min_tokens=1024):
+        # Seconds spent in each upload call
+        self.upload_latency = upload_latency
+        # Seconds until an uploaded document finishes importing
+        self.import_delay = import_delay
+        # Share of calls that fail with a 500 or a 429
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # Share of imports that finish with an error
+        self.import_error_rate = import_error_rate
+        self.seed = seed
+        # Streamed answers: seconds until the first chunk, between chunks,
+        # and the number of text chunks (about 8 words each)
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.answer_chunks = answer_chunks
+        # Seconds per generate_content call (routing, history summaries)
+        self.generate_latency = generate_latency
+        # Smallest prefix caches.create accepts
+        self.cache_min_tokens = cache_min_tokens
+
+
+class _State:
+    def __init__(self, config):
+        self.config = config
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.ids = itertools.count(1)
+        self.stores = {}       # store name -> types.FileSearchStore
+        self.documents = {}    # document name -> types.Document
+        self.operations = {}   # operation name -> (ready_at, document name, error)
+        self.caches = {}       # cached content name -> types.CachedContent
+
+    def count(self, method):
+        with self.lock:
+            self.calls[method] += 1
+
+    def maybe_fail(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.config.rate_limit_rate:
+            raise errors.ClientError(429, {'error': {'code': 429, 'message': 'Resource exhausted', 'status': 'RESOURCE_EXHAUSTED'}})
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            raise errors.ServerError(500, {'error': {'code': 500, 'message': 'Internal error', 'status': 'INTERNAL'}})
+
+
+class _Documents:
+    def __init__(self, state):
+        self._state = state
+
+    def list(self, parent, config=None):
+        self._state.count('documents.list')
+        with self._state.lock:
+            return [document for name, document in self._state.documents.items()
+                    if name.startswith(parent + '/')]
+
+    def delete(self, name, config=None):
+        self._state.count('documents.delete')
+        self._state.maybe_fail()
+        with self._state.lock:
+            if self._state.documents.pop(name, None) is None:
+                raise errors.ClientError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+
+
+class _FileSearchStores:
+    def __init__(self, state):
+        self._state = state
+        self.documents = _Documents(state)
+
+    def create(self, config=None):
+        self._state.count('file_search_stores.create')
+        config = config or {}
+        with self._state.lock:
+            name = f"fileSearchStores/fake-store-{next(self._state.ids)}"
+            store = types.FileSearchStore(name=name, display_name=config.get('display_name'))
+            self._state.stores[name] = store
+        return store
+
+    def get(self, name, config=None):
+        self._state.count('file_search_stores.get')
+        with self._state.lock:
+            store = self._state.stores.get(name)
+            if store is None:
+                raise errors.ClientError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+            return store.model_copy(update={
+                'active_documents_count': sum(1 for n in self._state.documents if n.startswith(name + '/'))
+            })
+
+    def upload_to_file_search_store(self, file_search_store_name, file, config=None):
+        self._state.count('file_search_stores.upload_to_file_search_store')
+        config = dict(config or {})
+        # Read the file like the real client does
+        with open(file, 'rb') as f:
+            size = len(f.read())
+        time.sleep(self._state.config.upload_latency)
+        self._state.maybe_fail()
+
+        with self._state.lock:
+            number = next(self._state.ids)
+            document_name = f"{file_search_store_name}/documents/doc-{number}"
+            operation_name = f"{file_search_store_name}/upload/operations/op-{number}"
+            failed = self._state.random.random() < self._state.config.import_error_rate
+            error = {'code': 13, 'message': 'Import failed'} if failed else None
+            self._state.operations[operation_name] = (
+                time.monotonic() + self._state.config.import_delay, document_name, error
+            )
+            if not failed:
+                self._state.documents[document_name] = types.Document(
+                    name=document_name,
+                    display_name=config.get('display_name'),
+                    size_bytes=size,
+                    custom_metadata=config.get('custom_metadata'),
+                )
+        return types.UploadToFileSearchStoreOperation(name=operation_name, done=False)
+
+
+class _Operations:
+    def __init__(self, state):
+        self._state = state
+
+    def get(self, operation, config=None):
+        self._state.count('operations.get')
+        self._state.maybe_fail()
+        with self._state.lock:
+            if operation.name not in self._state.operations:
+                raise errors.ClientError(404, {'error': {'code': 404, 'message': f'{operation.name} not found', 'status': 'NOT_FOUND'}})
+            ready_at, document_name, error = self._state.operations[operation.name]
+        if time.monotonic() < ready_at:
+            return types.UploadToFileSearchStoreOperation(name=operation.name, done=False)
+        if error:
+            return types.UploadToFileSearchStoreOperation(name=operation.name, done=True, error=error)
+        return types.UploadToFileSearchStoreOperation(
+            name=operation.name,
+            done=True,
+            response=types.UploadToFileSearchStoreResponse(document_name=document_name),
+        )
+
+
+class _Models:
+    def __init__(self, state):
+        self._state = state
+
+    def generate_content(self, model, contents, config=None):
+        self._state.count('models.generate_content')
+        time.sleep(self._state.config.generate_latency)
+        self._state.maybe_fail()
+        # Routing asks for JSON; an empty object leaves the rules' route
+        text = '{}' if config is not None and config.response_mime_type == 'application/json' else 'Shrnutí konverzace.'
+        return _response(text)
+
+
+class _Caches:
+    def __init__(self, state):
+        self._state = state
+
+    def _cached(self, name, model, ttl):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return types.CachedContent(
+            name=name, model=model, create_time=now, update_time=now,
+            expire_time=now + datetime.timedelta(seconds=float(ttl.rstrip('s'))),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=PREFIX_TOKENS),
+        )
+
+    def create(self, model, config=None):
+        self._state.count('caches.create')
+        self._state.maybe_fail()
+        if PREFIX_TOKENS < self._state.config.cache_min_tokens:
+            raise errors.ClientError(400, {'error': {
+                'code': 400, 'status': 'INVALID_ARGUMENT',
+                'message': f'Cached content is too small. total_token_count={PREFIX_TOKENS}, '
+                           f'min_total_token_count={self._state.config.cache_min_tokens}',
+            }})
+        with self._state.lock:
+            name = f"cachedContents/fake-{next(self._state.ids)}"
+            cached = self._state.caches[name] = self._cached(name, model, config.ttl)
+        return cached
+
+    def update(self, name, config=None):
+        self._state.count('caches.update')
+        with self._state.lock:
+            if name not in self._state.caches:
+                raise errors.ClientError(404, {'error': {'code': 404, 'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+            cached = self._state.caches[name] = self._cached(name, self._state.caches[name].model, config.ttl)
+        return cached
+
+    def delete(self, name, config=None):
+        self._state.count('caches.delete')
+        with self._state.lock:
+            self._state.caches.pop(name, None)
+
+
+def _response(text, grounding_metadata=None, usage_metadata=None):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role='model', parts=[types.Part(text=text)]) if text else None,
+            grounding_metadata=grounding_metadata,
+        )],
+        usage_metadata=usage_metadata,
+    )
+
+
+class _Chat:
+    """A chat whose answers stream in config.answer_chunks chunks."""
+
+    def __init__(self, state, model, history=None):
+        self._state = state
+        self._model = model
+        self._history = list(history or [])
+
+    def get_history(self, curated=False):
+        return list(self._history)
+
+    def _answer(self, message, config=None):
+        # Text chunks and the final chunk carrying grounding and usage; the
+        # prefix counts as cached when the config refers to a cache entry
+        with self._state.lock:
+            words = [
+                [self._state.random.choice(ANSWER_WORDS) for _ in range(8)]
+                for _ in range(self._state.config.answer_chunks)
+            ]
+            document = self._state.random.randrange(100000)
+        texts = [' '.join(chunk) + ' ' for chunk in words]
+        grounding = types.GroundingMetadata(grounding_chunks=[types.GroundingChunk(
+            retrieved_context=types.GroundingChunkRetrievedContext(
+                title=f"clanek-{document:06d}.md", text=' '.join(words[0])
+            )
+        )])
+        prompt_tokens = sum(len(str(content)) for content in self._history) // 4 + len(message) // 4 + PREFIX_TOKENS
+        output_tokens = sum(len(text) for text in texts) // 4
+        cached = config is not None and config.cached_content
+        if cached and cached not in self._state.caches:
+            raise errors.ClientError(403, {'error': {'code': 403, 'message': f'{cached} not found', 'status': 'PERMISSION_DENIED'}})
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            cached_content_token_count=PREFIX_TOKENS if cached else None,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+        return texts, _response(None, grounding, usage)
+
+    def _add_turn(self, message, texts):
+        self._history.append(types.Content(role='user', parts=[types.Part(text=message)]))
+        self._history.append(types.Content(role='model', parts=[types.Part(text=''.join(texts))]))
+
+    def send_message_stream(self, message, config=None):
+        self._state.count('chats.send_message_stream')
+        self._state.maybe_fail()
+        texts, last = self._answer(message, config)
+        time.sleep(self._state.config.first_token_delay)
+        for i, text in enumerate(texts):
+            if i:
+                time.sleep(self._state.config.chunk_delay)
+            yield _response(text)
+        yield last
+        self._add_turn(message, texts)
+
+
+class _AsyncChat(_Chat):
+    async def send_message_stream(self, message, config=None):
+        self._state.count('aio.chats.send_message_stream')
+        self._state.maybe_fail()
+        texts, last = self._answer(message, config)
+
+        async def stream():
+            await asyncio.sleep(self._state.config.first_token_delay)
+            for i, text in enumerate(texts):
+                if i:
+                    await asyncio.sleep(self._state.config.chunk_delay)
+                yield _response(text)
+            yield last
+            self._add_turn(message, texts)
+
+        return stream()
+
+
+class _Chats:
+    def __init__(self, state, chat_class=_Chat):
+        self._state = state
+        self._chat_class = chat_class
+
+    def create(self, model, config=None, history=None):
+        return self._chat_class(self._state, model, history)
+
+
+class _Aio:
+    def __init__(self, state):
+        self.chats = _Chats(state, _AsyncChat)
+
+    async def aclose(self):
+        pass
+
+
+class FakeClient:
+    """Drop-in for `genai.Client` covering file_search_stores, operations,
+    models.generate_content, caches and streaming chats, sync and async."""
+
+    def __init__(self, config=None):
+        self._state = _State(config or FakeConfig())
+        self.file_search_stores = _FileSearchStores(self._state)
+        self.operations = _Operations(self._state)
+        self.models = _Models(self._state)
+        self.caches = _Caches(self._state)
+        self.chats = _Chats(self._state)
+        self.aio = _Aio(self._state)
+
+    @property
+    def calls(self):
+        return self._state.calls
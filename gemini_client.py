@@ -0,0 +1,410 @@
+import asyncio
+import email.utils
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+
+from google import genai
+from google.genai import errors
+
+from chat_history import CHARS_PER_TOKEN, estimate_tokens
+
+logger = logging.getLogger("mvcr_ai.gemini")
+
+# Call priorities: chat answers go first, bulk uploads use what is left
+CHAT = 'chat'
+BULK = 'bulk'
+
+# HTTP status codes worth retrying
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+RETRY_DELAY_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)s$')
+
+# Client sections whose calls go through the limiter
+SECTIONS = ('models', 'caches', 'file_search_stores', 'operations')
+
+# Calls that may have taken effect even when they failed with a timeout or
+# a server error; they are only retried on 429, so a retry cannot leave a
+# duplicate document behind
+NON_IDEMPOTENT_METHODS = ('upload_to_file_search_store', 'import_file', 'upload')
+
+
+class TokenBucket:
+    """Refills at `per_minute` units a minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, reserve=0.0):
+        # Seconds until `amount` can be taken while leaving `reserve` of the
+        # capacity. Calls larger than the bucket wait for a full bucket and
+        # leave it in debt, and so do calls that would not fit next to the
+        # reserve, so they are never held forever.
+        needed = min(min(amount, self.capacity) + reserve * self.capacity, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+
+class RateLimiter:
+    """Requests and tokens per minute shared by all calls of a process.
+
+    Chat calls are served first: bulk calls wait while a chat call is
+    waiting, and never take the budget below `bulk_reserve` of the
+    capacity, so a chat question does not queue behind a full upload
+    window. Limits left as None are not enforced.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, bulk_reserve=0.2):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.bulk_reserve = bulk_reserve
+        self._condition = threading.Condition()
+        self._chat_waiting = 0
+        self.counters = {
+            'calls': 0,
+            'throttled': 0,
+            'throttled_seconds': 0.0,
+            'retried': 0,
+            'rate_limited': 0,
+            'failed': 0,
+        }
+
+    def _buckets(self, tokens):
+        if self.requests:
+            yield self.requests, 1
+        if self.tokens and tokens:
+            yield self.tokens, tokens
+
+    def acquire(self, priority=CHAT, tokens=0):
+        # Block until the call fits into the budget; returns the seconds waited
+        started = time.monotonic()
+        with self._condition:
+            self.counters['calls'] += 1
+            if priority == CHAT:
+                self._chat_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    for bucket, _ in self._buckets(tokens):
+                        bucket.refill(now)
+                    if priority == BULK and self._chat_waiting:
+                        delay = 0.05
+                    else:
+                        reserve = self.bulk_reserve if priority == BULK else 0.0
+                        delay = max((bucket.delay(amount, reserve) for bucket, amount in self._buckets(tokens)), default=0.0)
+                    if delay <= 0:
+                        for bucket, amount in self._buckets(tokens):
+                            bucket.level -= amount
+                        break
+                    self._condition.wait(delay)
+            finally:
+                if priority == CHAT:
+                    self._chat_waiting -= 1
+                    self._condition.notify_all()
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.counters['throttled'] += 1
+                self.counters['throttled_seconds'] += waited
+        return waited
+
+    def settle(self, estimated, actual):
+        # Correct the token bucket once the real usage of a call is known
+        if self.tokens and actual is not None:
+            with self._condition:
+                self.tokens.level += estimated - actual
+
+    def count(self, counter):
+        with self._condition:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self.counters)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+        return stats
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait: the Retry-After header, or the
+    # RetryInfo detail Gemini sends with 429 errors
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    value = headers.get('retry-after') if headers else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for detail in details.get('error', {}).get('details', None) or ():
+            match = RETRY_DELAY_PATTERN.match(str(detail.get('retryDelay', '')))
+            if match:
+                return float(match.group(1))
+    return None
+
+
+def usage_tokens(response):
+    usage = getattr(response, 'usage_metadata', None)
+    return usage.total_token_count if usage else None
+
+
+class RateLimitedClient:
+    """A `genai.Client` whose API calls go through a RateLimiter.
+
+    Calls failing with 429 or a server error are retried up to
+    `max_retries` times, after the Retry-After delay when the server sends
+    one and with jittered exponential backoff otherwise. Streams are retried
+    only until their first chunk arrives. Async calls taking longer than
+    `timeout` seconds after the limiter let them through raise
+    asyncio.TimeoutError; the wait for the limiter does not count. Everything
+    not wrapped here is passed through to the client.
+    """
+
+    def __init__(self, client, limiter=None, priority=CHAT, max_retries=4, base_delay=1.0, max_delay=60.0,
+                 timeout=None):
+        self.client = client
+        self.limiter = limiter or RateLimiter()
+        self.priority = priority
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name in SECTIONS:
+            return _Section(self, attribute)
+        if name == 'chats':
+            return _Chats(self, attribute)
+        if name == 'aio':
+            return _AsyncClient(self, attribute)
+        return attribute
+
+    def stats(self):
+        return self.limiter.stats()
+
+    def retry_delay(self, error, attempt, idempotent=True):
+        # Seconds to wait before retrying, or None to give up
+        code = getattr(error, 'code', None)
+        if code == 429:
+            self.limiter.count('rate_limited')
+        if (not isinstance(error, errors.APIError) or code not in RETRYABLE_CODES or attempt >= self.max_retries
+                or not idempotent and code != 429):
+            self.limiter.count('failed')
+            return None
+        self.limiter.count('retried')
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        else:
+            delay = min(self.max_delay, delay) + random.uniform(0, self.base_delay)
+        logger.info("Gemini call failed with %s, retry %d in %.1fs", code, attempt + 1, delay)
+        return delay
+
+    def call(self, function, *args, tokens=0, idempotent=True, **kwargs):
+        for attempt in itertools.count():
+            self.limiter.acquire(self.priority, tokens)
+            try:
+                response = function(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, idempotent)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.limiter.settle(tokens, usage_tokens(response))
+            return response
+
+    async def call_async(self, function, *args, tokens=0, idempotent=True, **kwargs):
+        # Async counterpart of call()
+        for attempt in itertools.count():
+            await asyncio.to_thread(self.limiter.acquire, self.priority, tokens)
+            try:
+                response = await asyncio.wait_for(function(*args, **kwargs), self.timeout)
+            except Exception as e:
+                delay = self.retry_delay(e, attempt, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.limiter.settle(tokens, usage_tokens(response))
+            return response
+
+    def stream(self, function, *args, tokens=0, **kwargs):
+        for attempt in itertools.count():
+            self.limiter.acquire(self.priority, tokens)
+            stream = function(*args, **kwargs)
+            try:
+                chunk = next(stream)
+            except StopIteration:
+                return
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            break
+        yield chunk
+        for chunk in stream:
+            yield chunk
+        self.limiter.settle(tokens, usage_tokens(chunk))
+
+    async def stream_async(self, function, *args, tokens=0, **kwargs):
+        # Async counterpart of stream(); returns the stream once its first
+        # chunk has arrived
+        for attempt in itertools.count():
+            await asyncio.to_thread(self.limiter.acquire, self.priority, tokens)
+            try:
+                stream = await function(*args, **kwargs)
+                chunk = await anext(stream)
+            except StopAsyncIteration:
+                chunk = None
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            return self._rest_async(chunk, stream, tokens)
+
+    async def _rest_async(self, chunk, stream, tokens):
+        if chunk is None:
+            return
+        yield chunk
+        async for chunk in stream:
+            yield chunk
+        self.limiter.settle(tokens, usage_tokens(chunk))
+
+
+def content_tokens(kwargs):
+    return len(str(kwargs.get('contents', ''))) // CHARS_PER_TOKEN
+
+
+class _Section:
+    # Methods of a client section (models, file_search_stores, ...) called
+    # through the limiter; `*_stream` methods are retried as streams
+    def __init__(self, owner, target):
+        self._owner = owner
+        self._target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return _Section(self._owner, attribute)
+        if name.endswith('_stream'):
+            return lambda *args, **kwargs: self._owner.stream(attribute, *args, tokens=content_tokens(kwargs), **kwargs)
+        idempotent = name not in NON_IDEMPOTENT_METHODS
+        return lambda *args, **kwargs: self._owner.call(
+            attribute, *args, tokens=content_tokens(kwargs), idempotent=idempotent, **kwargs
+        )
+
+
+class _AsyncSection:
+    # _Section for the sections of client.aio
+    def __init__(self, owner, target):
+        self._owner = owner
+        self._target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return _AsyncSection(self._owner, attribute)
+        if name.endswith('_stream'):
+            return lambda *args, **kwargs: self._owner.stream_async(
+                attribute, *args, tokens=content_tokens(kwargs), **kwargs
+            )
+        idempotent = name not in NON_IDEMPOTENT_METHODS
+        return lambda *args, **kwargs: self._owner.call_async(
+            attribute, *args, tokens=content_tokens(kwargs), idempotent=idempotent, **kwargs
+        )
+
+
+def message_tokens(chat, message):
+    return estimate_tokens(chat.get_history(curated=True)) + len(str(message)) // CHARS_PER_TOKEN
+
+
+class _Chats:
+    def __init__(self, owner, chats):
+        self._owner = owner
+        self._chats = chats
+
+    def create(self, *args, **kwargs):
+        return _Chat(self._owner, self._chats.create(*args, **kwargs))
+
+
+class _Chat:
+    def __init__(self, owner, chat):
+        self._owner = owner
+        self._chat = chat
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+    def send_message(self, message, config=None):
+        return self._owner.call(
+            self._chat.send_message, message, config=config, tokens=message_tokens(self._chat, message)
+        )
+
+    def send_message_stream(self, message, config=None):
+        return self._owner.stream(
+            self._chat.send_message_stream, message, config=config, tokens=message_tokens(self._chat, message)
+        )
+
+
+class _AsyncClient:
+    def __init__(self, owner, aio):
+        self._owner = owner
+        self._aio = aio
+        self.chats = _AsyncChats(owner, aio.chats)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._aio, name)
+        if name in SECTIONS:
+            return _AsyncSection(self._owner, attribute)
+        return attribute
+
+
+class _AsyncChats:
+    def __init__(self, owner, chats):
+        self._owner = owner
+        self._chats = chats
+
+    def create(self, *args, **kwargs):
+        return _AsyncChat(self._owner, self._chats.create(*args, **kwargs))
+
+
+class _AsyncChat:
+    def __init__(self, owner, chat):
+        self._owner = owner
+        self._chat = chat
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+    async def send_message_stream(self, message, config=None):
+        return await self._owner.stream_async(
+            self._chat.send_message_stream, message, config=config, tokens=message_tokens(self._chat, message)
+        )
+
+
+def create_client(api_key=None, priority=CHAT, requests_per_minute=None, tokens_per_minute=None,
+                  max_retries=4, bulk_reserve=0.2):
+    # genai.Client behind a RateLimiter; api_key None reads GEMINI_API_KEY
+    client = genai.Client(api_key=api_key) if api_key else genai.Client()
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute, bulk_reserve)
+    return RateLimitedClient(client, limiter, priority, max_retries)
@@ -0,0 +1,318 @@
+import argparse
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from chat_core import source_url
+from metadata_index import METADATA_CSV, load_metadata_index
+from query_router import ARCHIVE_PATTERN, fold
+from sync_manifest import SOURCE_EXTENSIONS, scan_source_files
+
+# BM25 index over source_files and the article names from files_metadata.csv
+LEXICAL_INDEX = 'lexical_index.db'
+
+# Text formats whose body is indexed; other files by name and metadata only
+TEXT_EXTENSIONS = ('.md', '.txt')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Article names and file names count more than the body text
+TITLE_WEIGHT = 3
+FILENAME_WEIGHT = 2
+
+# Memory-map up to this much of the index file
+MMAP_SIZE = 1 << 30
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Common Czech endings, folded; the longest matching one is stripped
+SUFFIXES = sorted((
+    'ovani', 'eni', 'ani', 'ost', 'ami', 'emi', 'ich', 'ych', 'ech', 'ove', 'eho', 'emu',
+    'ymi', 'imi', 'ovi', 'ou', 'um', 'em', 'om', 'am', 'ho', 'mu', 'ch', 'a', 'e', 'i', 'o', 'u', 'y',
+), key=len, reverse=True)
+
+STOPWORDS = frozenset(fold(word) for word in (
+    'a', 'i', 'o', 'u', 'v', 've', 'na', 'za', 'z', 'ze', 'do', 'k', 'ke', 's', 'se', 'si', 'mi', 'me',
+    'mě', 'mne', 'mně', 'je', 'jsou', 'byl', 'to', 'ten', 'ta', 'ty', 'pro', 'od', 'po', 'při', 'jak',
+    'co', 'kde', 'kdy', 'který', 'která', 'které', 'rok', 'roku', 'roce', 'najdi', 'najít', 'vyhledej',
+    'dohledej', 'hledám', 'hledat', 'ukaž', 'dej', 'pošli', 'odkaz', 'odkazy', 'chci', 'prosím',
+))
+
+# Questions asking for a document rather than for an answer
+LOOKUP_PATTERN = re.compile(
+    r'^\s*(najdi|najdete|vyhledej|vyhledejte|dohledej|hledam|ukaz|ukazte|dej mi odkaz|posli|'
+    r'kde (najdu|je|jsou) (report|zprav|dokument|clan|tiskov|vyrocni|statistik|formular|pdf)|'
+    r'odkaz na)\b'
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the local BM25 index used for document lookups in the chat."
+    )
+    parser.add_argument('--source-dir', type=Path, default=Path('source_files'))
+    parser.add_argument('--metadata-csv', default=METADATA_CSV)
+    parser.add_argument('--index', default=LEXICAL_INDEX)
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 1,
+        help="Number of tokenizing processes (default: number of CPUs)"
+    )
+    parser.add_argument('--rebuild', action='store_true', help="Index every file again")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def stem(token):
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    # Case and diacritics insensitive terms; years and other numbers are kept
+    return [stem(token) for token in TOKEN_PATTERN.findall(fold(text)) if token not in STOPWORDS]
+
+
+def is_lookup_question(question):
+    return LOOKUP_PATTERN.match(fold(question)) is not None
+
+
+def document_terms(item):
+    # Worker: weighted term frequencies of one document
+    relative, file_path, title, year = item
+    terms = Counter()
+    for term in tokenize(title):
+        terms[term] += TITLE_WEIGHT
+    for term in tokenize(re.sub(r'[-_.]', ' ', Path(relative).stem)):
+        terms[term] += FILENAME_WEIGHT
+    if year:
+        terms[str(year)] += TITLE_WEIGHT
+    if relative.lower().endswith(TEXT_EXTENSIONS):
+        terms.update(tokenize(Path(file_path).read_text(encoding='utf-8', errors='replace')))
+    return relative, dict(terms)
+
+
+def _metadata_fields(custom_metadata):
+    title, year, archived = '', None, False
+    for item in custom_metadata or ():
+        if item.key == 'article_name':
+            title = item.string_value
+        elif item.key == 'article_year':
+            year = int(item.numeric_value)
+        elif item.key == 'is_archived':
+            archived = item.numeric_value == 1
+    return title, year, archived
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            year INTEGER,
+            length INTEGER NOT NULL,
+            archived INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            doc_id INTEGER NOT NULL,
+            tf INTEGER NOT NULL,
+            PRIMARY KEY (term, doc_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+    ''')
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(documents)')}
+    if 'archived' not in columns:
+        # Indexes from before archive flags; forgetting the CSV signature
+        # indexes every file again with its flag
+        with connection:
+            connection.execute('ALTER TABLE documents ADD COLUMN archived INTEGER NOT NULL DEFAULT 0')
+            connection.execute("DELETE FROM settings WHERE key = 'metadata_csv'")
+    return connection
+
+
+def build_index(source_dir, index_path=LEXICAL_INDEX, metadata_csv=METADATA_CSV, workers=1, rebuild=False):
+    # Index new and changed files, and drop removed ones. Everything is
+    # indexed again when files_metadata.csv changes, since titles, years
+    # and archive flags come from it.
+    started = time.perf_counter()
+    connection = connect(index_path)
+    if os.path.exists(metadata_csv):
+        metadata, _ = load_metadata_index(metadata_csv)
+        csv_stat = os.stat(metadata_csv)
+        csv_signature = f"{csv_stat.st_size}:{csv_stat.st_mtime_ns}"
+    else:
+        print(f"{metadata_csv} not found, indexing without article names and years")
+        metadata, csv_signature = None, 'none'
+    row = connection.execute("SELECT value FROM settings WHERE key = 'metadata_csv'").fetchone()
+    if rebuild or not row or row[0] != csv_signature:
+        with connection:
+            connection.execute('DELETE FROM postings')
+            connection.execute('DELETE FROM documents')
+            connection.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('metadata_csv', ?)", (csv_signature,)
+            )
+
+    scanned = scan_source_files(source_dir, SOURCE_EXTENSIONS)
+    indexed = {
+        path: (doc_id, size, mtime_ns)
+        for doc_id, path, size, mtime_ns in connection.execute('SELECT doc_id, path, size, mtime_ns FROM documents')
+    }
+    removed = [doc_id for path, (doc_id, _, _) in indexed.items() if path not in scanned]
+    deleted = len(removed)
+    jobs = []
+    details = {}
+    for relative, (file_path, size, mtime_ns) in scanned.items():
+        entry = indexed.get(relative)
+        if entry and entry[1:] == (size, mtime_ns):
+            continue
+        if entry:
+            removed.append(entry[0])
+        title, year, archived = _metadata_fields(metadata.get(file_path.name) if metadata else None)
+        title = title or Path(relative).stem
+        jobs.append((relative, file_path, title, year))
+        details[relative] = (title, year, archived)
+
+    with connection:
+        connection.executemany('DELETE FROM postings WHERE doc_id = ?', [(doc_id,) for doc_id in removed])
+        connection.executemany('DELETE FROM documents WHERE doc_id = ?', [(doc_id,) for doc_id in removed])
+        if jobs:
+            chunksize = max(1, len(jobs) // (workers * 8))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for relative, terms in executor.map(document_terms, jobs, chunksize=chunksize):
+                    title, year, archived = details[relative]
+                    _, size, mtime_ns = scanned[relative]
+                    doc_id = connection.execute(
+                        'INSERT INTO documents (path, size, mtime_ns, title, year, length, archived) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (relative, size, mtime_ns, title, year, sum(terms.values()), int(archived))
+                    ).lastrowid
+                    connection.executemany(
+                        'INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)',
+                        [(term, doc_id, tf) for term, tf in terms.items()]
+                    )
+    total = connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+    connection.close()
+    print(f"Indexed {len(jobs)} files, removed {deleted}, {total} documents in {index_path} "
+          f"({time.perf_counter() - started:.1f}s)")
+    return total
+
+
+def index_version(path=LEXICAL_INDEX):
+    # Modification times of the index and its write-ahead log; they change
+    # whenever build_index writes to the index
+    return tuple(
+        os.stat(file_path).st_mtime_ns if os.path.exists(file_path) else None
+        for file_path in (path, f"{path}-wal")
+    )
+
+
+class LexicalIndex:
+    """Read-only BM25 search over the index built by build_index.
+
+    The SQLite file is memory-mapped, so opening it reads only the document
+    table; postings are looked up per query term. Archived documents are
+    left out unless the query asks for the archive, as in query_router.
+    """
+
+    def __init__(self, path=LEXICAL_INDEX):
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.connection.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        self.lock = threading.Lock()
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(documents)')}
+        # Indexes built before archive flags have none until lexical_index.py
+        # runs again
+        archived = 'archived' if 'archived' in columns else '0'
+        self.documents = {
+            doc_id: (path, title, year, length, bool(is_archived))
+            for doc_id, path, title, year, length, is_archived in self.connection.execute(
+                f'SELECT doc_id, path, title, year, length, {archived} FROM documents'
+            )
+        }
+        # 1 for an empty index or one of empty documents, so BM25 does not
+        # divide by zero
+        self.average_length = (
+            sum(document[3] for document in self.documents.values()) / len(self.documents)
+            if self.documents else 0
+        ) or 1
+
+    def __len__(self):
+        return len(self.documents)
+
+    def search(self, query, limit=5, exclude_archive=True):
+        # Ranked documents with their BM25 score and the share of query
+        # terms they contain
+        terms = set(tokenize(query))
+        if not terms or not self.documents:
+            return []
+        skip_archived = exclude_archive and not ARCHIVE_PATTERN.search(fold(query))
+        scores = Counter()
+        matched = Counter()
+        total = len(self.documents)
+        with self.lock:
+            for term in terms:
+                postings = self.connection.execute(
+                    'SELECT doc_id, tf FROM postings WHERE term = ?', (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings:
+                    length, archived = self.documents[doc_id][3:]
+                    if archived and skip_archived:
+                        continue
+                    scores[doc_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / self.average_length))
+                    matched[doc_id] += 1
+
+        results = []
+        for doc_id, score in scores.most_common(limit):
+            path, title, year = self.documents[doc_id][:3]
+            results.append({
+                'title': title,
+                'url': source_url(Path(path).name),
+                'year': year,
+                'score': round(score, 3),
+                'coverage': matched[doc_id] / len(terms),
+            })
+        return results
+
+    def lookup(self, question, min_coverage=0.6, limit=5, exclude_archive=True):
+        # Documents for a lookup-style question, or [] when the question
+        # should go to the model: it asks for an answer, or no document
+        # matches most of its terms
+        if not is_lookup_question(question):
+            return []
+        results = self.search(question, limit, exclude_archive)
+        if not results or results[0]['coverage'] < min_coverage:
+            return []
+        return [result for result in results if result['score'] >= results[0]['score'] / 2]
+
+
+def main():
+    args = parse_args()
+    build_index(args.source_dir, args.index, args.metadata_csv, args.workers, args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,73 @@
 from google import genai
 from google.genai import types
-import time
 
-client = genai.Client(api_key='***REMOVED***')
+from chat_core import MODEL_NAME, extract_sources
+from gemini_client import CHAT, RateLimitedClient
 
-# Read the file search store name from the saved file
-with open('file_search_store_name.txt', 'r') as f:
-    store_name = f.read().strip()
+# File with the file search store name, written by upload_file_search_store.py
+STORE_NAME_FILE = 'file_search_store_name.txt'
 
-print(f"Using File Search Store: {store_name}\n")
 
-# Ask a question about the file
-response = client.models.generate_content(
-    model="gemini-2.5-flash",
-    contents="""Kdo je aktualni prezident?""",
-    config=types.GenerateContentConfig(
+def create_client(limiter=None, priority=CHAT, max_retries=4, timeout=None):
+    # Retries 429s and server errors with backoff
+    return RateLimitedClient(
+        genai.Client(api_key='***REMOVED***'), limiter, priority, max_retries, timeout=timeout
+    )
+
+
+def read_store_name():
+    # Read the file search store name from the saved file
+    with open(STORE_NAME_FILE, 'r') as f:
+        return f.read().strip()
+
+
+def build_config(store_name, metadata_filter=None):
+    return types.GenerateContentConfig(
         tools=[
             types.Tool(
                 file_search=types.FileSearch(
                     file_search_store_names=[store_name],
-                    # metadata_filter="is_news=1"  # Uncomment to filter by metadata
+                    metadata_filter=metadata_filter  # e.g. "is_news=1"
                 )
             )
         ]
     )
-)
-
-print(response.text)
-print("\n" + "="*60)
-print("Grounding Metadata:")
-print("="*60)
-
-grounding = response.candidates[0].grounding_metadata
-if grounding and grounding.grounding_chunks:
-    # Cache document metadata to avoid repeated API calls
-
-    for i, chunk in enumerate(grounding.grounding_chunks, 1):
-        print(f"\n{'='*60}")
-        print(f"Chunk {i}:")
-        print('='*60)
-        
-        if hasattr(chunk, 'retrieved_context') and chunk.retrieved_context:
-            ctx = chunk.retrieved_context
-            url = f"https://policie.gov.cz/clanek/{ctx.title[:-3]}.aspx"
-            print(f"  Document: {ctx.title}")
-            print(f"  Source URI: {url}")
+
+
+def main():
+    client = create_client()
+    store_name = read_store_name()
+
+    print(f"Using File Search Store: {store_name}\n")
+
+    # Ask a question about the file
+    response = client.models.generate_content(
+        model=MODEL_NAME,
+        contents="""Kdo je aktualni prezident?""",
+        config=build_config(store_name)
+    )
+
+    print(response.text)
+    print("\n" + "="*60)
+    print("Grounding Metadata:")
+    print("="*60)
+
+    sources = extract_sources(response)
+    if sources:
+        for i, source in enumerate(sources, 1):
+            print(f"\n{'='*60}")
+            print(f"Chunk {i}:")
+            print('='*60)
+            print(f"  Document: {source['title']}")
+            print(f"  Source URI: {source['url']}")
             # Show a snippet of the text
-            if hasattr(ctx, 'text') and ctx.text:
-                snippet = ctx.text[:200].replace('\n', ' ')
-                print(f"  Text snippet: {snippet}...")
-else:
-    print("No grounding metadata available")
+            if source['snippet']:
+                print(f"  Text snippet: {source['snippet']}")
+    else:
+        print("No grounding metadata available")
+
+    print(response.candidates[0].grounding_metadata)
+
 
-print(response.candidates[0].grounding_metadata)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
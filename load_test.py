@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+from google import genai
+
+import chat_server
+from chat_metrics import QUANTILES, MetricsRecorder, process_stats, quantile
+from fake_gemini import FakeClient, FakeConfig
+from gemini_client import RateLimitedClient, RateLimiter
+from llm import read_store_name
+from session_store import SessionStore
+from store_partitions import StorePartitions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded conversations against the chat logic and report latency and capacity."
+    )
+    parser.add_argument(
+        'input',
+        help="JSONL with {\"session\", \"question\", \"timestamp\", \"total_time\"} lines, as written by "
+             "CONVERSATION_LOG / --conversation-log; lines without a session are one-question sessions"
+    )
+    parser.add_argument('--concurrency', type=int, default=10, help="Conversations replayed at once (default: 10)")
+    parser.add_argument('--repeat', type=int, default=1, help="Replay the recorded conversations this many times (default: 1)")
+    parser.add_argument(
+        '--think-scale', type=float, default=1.0,
+        help="Multiply the recorded pauses between questions, 0 for none (default: 1)"
+    )
+    parser.add_argument('--max-think', type=float, default=30.0, help="Longest pause in seconds (default: 30)")
+    parser.add_argument('--url', default=None, help="Replay against a running chat_server.py instead of in-process")
+    parser.add_argument('--real', action='store_true', help="In-process with the real Gemini API ($GEMINI_API_KEY)")
+    parser.add_argument('--store', default=None, help="File Search store for --real (default: file_search_store_name.txt)")
+    parser.add_argument('--partitions', default=None, help="Partitioned store layout for --real")
+    parser.add_argument('--first-token-delay', type=float, default=0.8, help="Fake API: seconds to the first chunk (default: 0.8)")
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help="Fake API: seconds between chunks (default: 0.05)")
+    parser.add_argument('--answer-chunks', type=int, default=20, help="Fake API: chunks per answer (default: 20)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fake API: share of calls failing with 500")
+    parser.add_argument('--first-token-timeout', type=float, default=30.0,
+                        help="In-process: seconds to the first text of a model call, 0 for no limit (default: 30)")
+    parser.add_argument('--answer-timeout', type=float, default=120.0,
+                        help="In-process: seconds per answer, 0 for no limit (default: 120)")
+    parser.add_argument('--json', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.url and args.real:
+        parser.error("--real applies to in-process replays only")
+    return args
+
+
+def load_conversations(path):
+    # [[(question, seconds to wait before asking it)]]: the pause is the
+    # recorded gap between the previous answer finishing and the question
+    sessions = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get('question'):
+                continue
+            sessions[item.get('session') or f"line-{line_num}"].append(item)
+
+    conversations = []
+    for turns in sessions.values():
+        turns.sort(key=lambda turn: turn.get('timestamp') or 0)
+        conversation = []
+        previous_end = None
+        for turn in turns:
+            timestamp = turn.get('timestamp')
+            think = max(0.0, timestamp - previous_end) if timestamp and previous_end else 0.0
+            conversation.append((turn['question'], think))
+            if timestamp:
+                previous_end = timestamp + (turn.get('total_time') or 0)
+        conversations.append(conversation)
+    return conversations
+
+
+class LocalTarget:
+    """ChatService in this process, driven like chat_server's endpoints."""
+
+    def __init__(self, client, store_names, partitions, work_dir, first_token_timeout, answer_timeout):
+        server_args = chat_server.parse_args([
+            '--session-db', str(Path(work_dir) / 'sessions.db'), '--metrics-log', '',
+            '--first-token-timeout', str(first_token_timeout), '--answer-timeout', str(answer_timeout),
+        ])
+        self.service = chat_server.ChatService(
+            client, store_names, server_args, MetricsRecorder(), SessionStore(server_args.session_db), partitions
+        )
+
+    async def create_session(self):
+        return await asyncio.to_thread(self.service.create_session)
+
+    async def delete_session(self, session_id):
+        await asyncio.to_thread(self.service.delete_session, session_id)
+
+    async def stream(self, session_id, question):
+        session = await self.service.get_session(session_id)
+        async with contextlib.aclosing(self.service.answer(session_id, session, question)) as events:
+            async for event, data in events:
+                yield event, data
+
+    async def process_stats(self):
+        return process_stats()
+
+    def api_stats(self):
+        return self.service.client.stats()
+
+    async def close(self):
+        await self.service.client.aio.aclose()
+        self.service.session_store.close()
+
+
+class RemoteTarget:
+    """A running chat_server.py, over HTTP and Server-Sent Events."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600))
+
+    async def create_session(self):
+        async with self.http.post(f"{self.base_url}/sessions", json={'history': []}) as response:
+            response.raise_for_status()
+            return (await response.json())['session_id']
+
+    async def delete_session(self, session_id):
+        async with self.http.delete(f"{self.base_url}/sessions/{session_id}"):
+            pass
+
+    async def stream(self, session_id, question):
+        async with self.http.post(
+            f"{self.base_url}/sessions/{session_id}/messages", json={'message': question}
+        ) as response:
+            response.raise_for_status()
+            event = 'message'
+            data_lines = []
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    if data_lines:
+                        yield event, json.loads('\n'.join(data_lines))
+                    event = 'message'
+                    data_lines = []
+                elif line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data_lines.append(line[len('data:'):].strip())
+
+    async def process_stats(self):
+        async with self.http.get(f"{self.base_url}/health") as response:
+            return (await response.json()).get('process')
+
+    def api_stats(self):
+        return None
+
+    async def close(self):
+        await self.http.close()
+
+
+async def replay_conversation(target, conversation, args, results):
+    session_id = await target.create_session()
+    for question, think in conversation:
+        pause = min(think * args.think_scale, args.max_think)
+        if pause > 0:
+            await asyncio.sleep(pause)
+        started = time.perf_counter()
+        result = {'time_to_first_token': None, 'total_time': None, 'resets': 0, 'partial': False, 'error': None}
+        try:
+            async for event, data in target.stream(session_id, question):
+                if event == 'chunk' and result['time_to_first_token'] is None:
+                    result['time_to_first_token'] = time.perf_counter() - started
+                elif event == 'reset':
+                    result['resets'] += 1
+                elif event == 'done':
+                    result['partial'] = bool(data.get('interrupted'))
+                elif event == 'error':
+                    result['error'] = data['message']
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['total_time'] = time.perf_counter() - started
+        results.append(result)
+    await target.delete_session(session_id)
+
+
+async def sample_process(target, samples, interval=0.5):
+    # Keep sampling the server's CPU time and memory until cancelled
+    while True:
+        stats = await target.process_stats()
+        if stats:
+            samples.append(stats)
+        await asyncio.sleep(interval)
+
+
+def summarize(values):
+    values = sorted(value for value in values if value is not None)
+    return {f"p{int(q * 100)}": quantile(values, q) for q in QUANTILES}
+
+
+async def run_replay(args, conversations):
+    work_dir = tempfile.mkdtemp(prefix='load-test-')
+    if args.url:
+        target = RemoteTarget(args.url)
+    else:
+        if args.real:
+            # Reads GEMINI_API_KEY from the environment
+            client = genai.Client()
+            partitions = StorePartitions.load(args.partitions) if args.partitions else None
+            store_names = partitions.store_names() if partitions else [args.store or read_store_name()]
+        else:
+            client = FakeClient(FakeConfig(
+                first_token_delay=args.first_token_delay,
+                chunk_delay=args.chunk_delay,
+                answer_chunks=args.answer_chunks,
+                error_rate=args.error_rate,
+            ))
+            partitions, store_names = None, ['fileSearchStores/fake-store']
+        target = LocalTarget(
+            RateLimitedClient(client, RateLimiter()), store_names, partitions, work_dir,
+            args.first_token_timeout, args.answer_timeout
+        )
+
+    results = []
+    samples = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(conversation):
+        async with semaphore:
+            await replay_conversation(target, conversation, args, results)
+
+    try:
+        before = await target.process_stats()
+        sampler = asyncio.create_task(sample_process(target, samples))
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(conversation) for conversation in conversations * args.repeat))
+        wall_time = time.perf_counter() - started
+        sampler.cancel()
+        after = await target.process_stats()
+        api_stats = target.api_stats()
+    finally:
+        await target.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    answered = [result for result in results if result['error'] is None]
+    report = {
+        'target': args.url or ('gemini' if args.real else 'fake'),
+        'conversations': len(conversations) * args.repeat,
+        'concurrency': args.concurrency,
+        'turns': len(results),
+        'errors': len(results) - len(answered),
+        'resets': sum(result['resets'] for result in results),
+        'partial': sum(1 for result in answered if result['partial']),
+        'wall_time': round(wall_time, 3),
+        'turns_per_second': round(len(answered) / wall_time, 3) if wall_time > 0 else None,
+        'time_to_first_token': summarize(result['time_to_first_token'] for result in answered),
+        'total_time': summarize(result['total_time'] for result in answered),
+        'api': api_stats,
+    }
+    if before and after:
+        cpu_seconds = after['cpu_seconds'] - before['cpu_seconds']
+        rss_values = [sample['rss_bytes'] for sample in samples + [after] if sample.get('rss_bytes')]
+        report['process'] = {
+            'cpu_seconds': round(cpu_seconds, 3),
+            'cpu_utilization': round(cpu_seconds / wall_time, 3) if wall_time > 0 else None,
+            'rss_bytes_start': before.get('rss_bytes'),
+            'rss_bytes_peak': max(rss_values) if rss_values else None,
+        }
+    errors = [result['error'] for result in results if result['error']]
+    return report, errors
+
+
+def print_report(report, errors):
+    print("\n" + "="*60)
+    print("Load test summary")
+    print("="*60)
+    print(f"Target: {report['target']}")
+    print(f"Conversations: {report['conversations']} (concurrency {report['concurrency']})")
+    print(f"Questions: {report['turns']}, failed: {report['errors']}, asked again: {report['resets']}, "
+          f"cut off by the deadline: {report['partial']}")
+    print(f"Wall time: {report['wall_time']:.2f}s")
+    print(f"Throughput: {report['turns_per_second']} answers/s")
+    for field, label in (('time_to_first_token', 'Time to first token'), ('total_time', 'Full answer')):
+        values = report[field]
+        print(f"{label}: " + ", ".join(
+            f"{name} {value:.2f}s" if value is not None else f"{name} n/a" for name, value in values.items()
+        ))
+    process = report.get('process')
+    if process:
+        note = " (includes the load generator)" if report['target'] in ('fake', 'gemini') else ""
+        print(f"CPU: {process['cpu_seconds']:.2f}s, {process['cpu_utilization'] * 100:.0f}% of one core{note}")
+        if process['rss_bytes_peak']:
+            print(f"Memory: {process['rss_bytes_start'] / (1024 * 1024):.1f} MiB at start, "
+                  f"{process['rss_bytes_peak'] / (1024 * 1024):.1f} MiB peak")
+    if report['api']:
+        api = report['api']
+        print(f"API calls: {api['calls']}, throttled: {api['throttled']}, retried: {api['retried']}")
+    if errors:
+        print("\nErrors:")
+        for error, count in sorted(((error, errors.count(error)) for error in set(errors)), key=lambda item: -item[1])[:10]:
+            print(f"  {count}x {error}")
+
+
+def main():
+    args = parse_args()
+    conversations = load_conversations(args.input)
+    if not conversations:
+        print(f"No questions in {args.input}")
+        return
+    print(f"Replaying {len(conversations)} conversations ({sum(map(len, conversations))} questions) "
+          f"x{args.repeat} with concurrency {args.concurrency}...")
+    report, errors = asyncio.run(run_replay(args, conversations))
+    print_report(report, errors)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': vars(args), 'report': report}, f, indent=2)
+        print(f"\nResults written to: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import csv
+import os
+import pickle
+from pathlib import PurePath
+
+from google.genai import types
+
+# Article metadata exported from the website
+METADATA_CSV = 'files_metadata.csv'
+
+# Parsed index cached between runs, invalidated when the CSV changes
+METADATA_CACHE = 'files_metadata.cache.pickle'
+
+# Bump when the cached structure changes
+CACHE_VERSION = 1
+
+# Original extensions kept in the names of converted documents
+CONVERTED_EXTENSIONS = ('.pdf', '.doc', '.docx')
+
+# Numeric flags must be 0 or 1
+FLAG_FIELDS = ('is_archived', 'is_news')
+
+
+class MetadataIndex:
+    """Typed custom metadata for each article, keyed by file stem.
+
+    `article_filename` in the CSV has no extension, so `article.md`,
+    `article.pdf` and `article.docx` all resolve to the same entry.
+    """
+
+    def __init__(self, by_stem, errors):
+        self.by_stem = by_stem
+        # [(csv line number, field, raw value)] for values that were rejected
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.by_stem)
+
+    def get(self, file_name):
+        # Returns a tuple of types.CustomMetadata, or None when the file
+        # has no row in the CSV
+        stem = PurePath(file_name).stem
+        if stem.lower().endswith(CONVERTED_EXTENSIONS):
+            # Markdown converted from a document, e.g. `article.pdf.md`
+            stem = PurePath(stem).stem
+        return self.by_stem.get(stem)
+
+
+def _csv_signature(csv_path):
+    stat = os.stat(csv_path)
+    return (CACHE_VERSION, os.path.abspath(csv_path), stat.st_size, stat.st_mtime_ns)
+
+
+def build_metadata_index(csv_path=METADATA_CSV):
+    by_stem = {}
+    errors = []
+    # Only article_name differs per row; the numeric fields repeat a handful
+    # of values, so identical CustomMetadata objects are shared
+    shared = {}
+
+    def numeric(key, value):
+        item = shared.get((key, value))
+        if item is None:
+            item = shared[(key, value)] = types.CustomMetadata(key=key, numeric_value=value)
+        return item
+
+    # Use utf-8-sig to handle BOM if present
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=';')
+        for row in reader:
+            filename = (row.get('article_filename') or '').strip()
+            if not filename or filename == 'NULL':
+                continue
+
+            custom_metadata = []
+            article_name = (row.get('article_name') or '').strip()
+            if article_name:
+                custom_metadata.append(
+                    types.CustomMetadata(key='article_name', string_value=article_name)
+                )
+
+            for field in FLAG_FIELDS:
+                value = (row.get(field) or '').strip()
+                if not value:
+                    continue
+                if value in ('0', '1'):
+                    custom_metadata.append(numeric(field, int(value)))
+                else:
+                    errors.append((reader.line_num, field, value))
+
+            article_year = (row.get('article_year') or '').strip()
+            if article_year and article_year != 'NULL':
+                if article_year.isdigit() and len(article_year) == 4:
+                    custom_metadata.append(numeric('article_year', int(article_year)))
+                else:
+                    errors.append((reader.line_num, 'article_year', article_year))
+
+            by_stem[filename] = tuple(custom_metadata)
+
+    return MetadataIndex(by_stem, errors)
+
+
+def load_metadata_index(csv_path=METADATA_CSV, cache_path=METADATA_CACHE):
+    # Load the index from the cache when it was built from the same CSV,
+    # otherwise parse the CSV and refresh the cache
+    signature = _csv_signature(csv_path)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached_signature, index = pickle.load(f)
+            if cached_signature == signature:
+                return index, True
+        except Exception:
+            pass
+
+    index = build_metadata_index(csv_path)
+    if cache_path:
+        temporary_path = f"{cache_path}.tmp"
+        with open(temporary_path, 'wb') as f:
+            pickle.dump((signature, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+    return index, False
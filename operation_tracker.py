@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class OperationTracker:
+    """Polls many long-running operations together until they finish.
+
+    Each operation is polled on its own schedule that starts at
+    `initial_delay` and backs off exponentially up to `max_delay`, while the
+    total number of `operations.get` calls is capped at `max_polls_per_second`.
+    Finished operations are reported as soon as they complete. Operations that
+    fail, or finish without a response, are put on `retry_queue` instead of
+    stopping the run, and so do operations the API no longer knows (404).
+    Operations that cannot be polled `max_poll_errors` times in a row may
+    still succeed, so they go to `unpolled` to be polled again later rather
+    than started anew.
+    """
+
+    def __init__(self, client, initial_delay=1.0, max_delay=30.0, backoff=2.0,
+                 max_polls_per_second=10.0, workers=4, max_poll_errors=5):
+        self.client = client
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.max_polls_per_second = max_polls_per_second
+        self.workers = workers
+        self.max_poll_errors = max_poll_errors
+
+        # Heap of (due_time, sequence, key, operation, delay, poll_errors)
+        self._pending = []
+        self._sequence = itertools.count()
+
+        self.succeeded = []
+        self.retry_queue = []
+        self.unpolled = []
+        self.polls = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, operation):
+        self._schedule(key, operation, self.initial_delay, 0)
+
+    def _schedule(self, key, operation, delay, poll_errors):
+        heapq.heappush(
+            self._pending,
+            (time.monotonic() + delay, next(self._sequence), key, operation, delay, poll_errors)
+        )
+
+    def run(self, on_complete=None):
+        """Poll until every operation is done or queued for retry.
+
+        `on_complete(key, operation, error)` is called from the calling thread
+        as soon as an operation finishes; `error` is None on success.
+        """
+        min_interval = 1.0 / self.max_polls_per_second
+        next_slot = time.monotonic()
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='poll') as executor:
+            while self._pending or in_flight:
+                now = time.monotonic()
+
+                # Start every poll that is due, within the global rate cap
+                while (self._pending and len(in_flight) < self.workers
+                       and self._pending[0][0] <= now and next_slot <= now):
+                    entry = heapq.heappop(self._pending)
+                    in_flight[executor.submit(self.client.operations.get, entry[3])] = entry
+                    self.polls += 1
+                    next_slot = max(next_slot, now) + min_interval
+
+                # Sleep until a poll returns or the next poll is allowed
+                timeout = None
+                if self._pending and len(in_flight) < self.workers:
+                    timeout = max(0.0, max(self._pending[0][0], next_slot) - time.monotonic())
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._handle(in_flight.pop(future), future, on_complete)
+
+        return self.succeeded, self.retry_queue
+
+    def _handle(self, entry, future, on_complete):
+        _, _, key, operation, delay, poll_errors = entry
+        next_delay = min(delay * self.backoff, self.max_delay)
+
+        try:
+            operation = future.result()
+        except Exception as e:
+            if getattr(e, 'code', None) == 404:
+                # The operation is gone (expired or unknown), so it has to
+                # be started again
+                self.retry_queue.append((key, e))
+                if on_complete:
+                    on_complete(key, operation, e)
+                return
+            poll_errors += 1
+            if poll_errors < self.max_poll_errors:
+                self._schedule(key, operation, next_delay, poll_errors)
+                return
+            self.unpolled.append((key, operation))
+            if on_complete:
+                on_complete(key, operation, e)
+            return
+
+        if not operation.done:
+            self._schedule(key, operation, next_delay, 0)
+        elif operation.error or operation.response is None:
+            error = operation.error or "Operation finished without a response"
+            self.retry_queue.append((key, error))
+            if on_complete:
+                on_complete(key, operation, error)
+        else:
+            self.succeeded.append((key, operation))
+            if on_complete:
+                on_complete(key, operation, None)
@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sync_manifest import SOURCE_EXTENSIONS, scan_source_files, write_if_changed
+
+# Normalized copies of source_files, uploaded instead of the originals
+PROCESSED_DIR = Path('processed_files')
+
+# What the last run stripped and collapsed
+REPORT_FILE = 'preprocess_report.json'
+
+# Scraped text formats; other files are copied unchanged
+TEXT_EXTENSIONS = ('.md', '.txt')
+
+# MinHash signature of NUM_BANDS x ROWS_PER_BAND values. 16 bands of 8 rows
+# make documents with a Jaccard similarity of about 0.7 and more candidates.
+NUM_BANDS = 16
+ROWS_PER_BAND = 8
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_WORDS = 5
+
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+PERMUTATIONS = [
+    (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+WORD_PATTERN = re.compile(r'\w+')
+ALNUM_PATTERN = re.compile(r'[^\W_]')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Strip boilerplate from source_files and drop near-duplicate documents."
+    )
+    parser.add_argument('--source-dir', type=Path, default=Path('source_files'))
+    parser.add_argument('--output-dir', type=Path, default=PROCESSED_DIR)
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count() or 1,
+        help="Number of worker processes (default: number of CPUs)"
+    )
+    parser.add_argument(
+        '--boilerplate-share', type=float, default=0.3,
+        help="Lines found in at least this share of documents are boilerplate (default: 0.3)"
+    )
+    parser.add_argument(
+        '--boilerplate-min-docs', type=int, default=5,
+        help="...and in at least this many documents (default: 5)"
+    )
+    parser.add_argument(
+        '--similarity', type=float, default=0.8,
+        help="Estimated Jaccard similarity at which documents are near-duplicates (default: 0.8)"
+    )
+    parser.add_argument('--report', default=REPORT_FILE)
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if not 0 < args.similarity <= 1:
+        parser.error("--similarity must be in (0, 1]")
+    return args
+
+
+def normalize_line(line):
+    return ' '.join(line.split())
+
+
+def read_text(file_path):
+    return Path(file_path).read_text(encoding='utf-8', errors='replace')
+
+
+def line_keys(file_path):
+    # Distinct normalized lines of one document, as short digests. Lines
+    # without letters or digits (blank lines, table rules, separators) are
+    # never treated as boilerplate.
+    keys = set()
+    for line in read_text(file_path).splitlines():
+        line = normalize_line(line)
+        if ALNUM_PATTERN.search(line):
+            keys.add(hashlib.blake2b(line.encode('utf-8'), digest_size=8).digest())
+    return keys
+
+
+def strip_boilerplate(text, boilerplate):
+    lines = []
+    for line in text.splitlines():
+        normalized = normalize_line(line)
+        if hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest() in boilerplate:
+            continue
+        lines.append(line.rstrip())
+    # Collapse the blank lines left behind
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip() + '\n'
+
+
+def minhash(text):
+    words = WORD_PATTERN.findall(text.casefold())
+    if not words:
+        return None
+    shingles = {
+        ' '.join(words[i:i + SHINGLE_WORDS])
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+    }
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        for shingle in shingles
+    ]
+    return tuple(
+        min((a * h + b) % MERSENNE_PRIME for h in hashes)
+        for a, b in PERMUTATIONS
+    )
+
+
+# Boilerplate line digests, sent once to each worker process
+_boilerplate = frozenset()
+
+
+def _init_worker(boilerplate):
+    global _boilerplate
+    _boilerplate = boilerplate
+
+
+def clean_document(item):
+    # Worker: strip boilerplate and sign the result
+    relative, file_path = item
+    text = read_text(file_path)
+    cleaned = strip_boilerplate(text, _boilerplate)
+    return relative, len(text.encode('utf-8')), cleaned, minhash(cleaned)
+
+
+def similarity(signature, other):
+    return sum(x == y for x, y in zip(signature, other)) / NUM_PERM
+
+
+def find_duplicates(signatures, sizes, threshold):
+    # LSH over the signature bands; candidate pairs are checked against the
+    # estimated similarity and merged into clusters. Each cluster keeps its
+    # longest document. Returns {kept: [(duplicate, similarity)]}.
+    buckets = defaultdict(list)
+    for relative, signature in signatures.items():
+        for band in range(NUM_BANDS):
+            start = band * ROWS_PER_BAND
+            buckets[band, signature[start:start + ROWS_PER_BAND]].append(relative)
+
+    parent = {relative: relative for relative in signatures}
+
+    def find(relative):
+        while parent[relative] != relative:
+            parent[relative] = parent[parent[relative]]
+            relative = parent[relative]
+        return relative
+
+    for members in buckets.values():
+        for i, first in enumerate(members):
+            for other in members[i + 1:]:
+                if find(first) != find(other) and similarity(signatures[first], signatures[other]) >= threshold:
+                    parent[find(other)] = find(first)
+
+    clusters = defaultdict(list)
+    for relative in signatures:
+        clusters[find(relative)].append(relative)
+
+    duplicates = {}
+    for members in clusters.values():
+        if len(members) < 2:
+            continue
+        kept = max(members, key=lambda relative: (sizes[relative], relative))
+        duplicates[kept] = sorted(
+            (relative, round(similarity(signatures[kept], signatures[relative]), 3))
+            for relative in members if relative != kept
+        )
+    return duplicates
+
+
+def copy_if_changed(source, target):
+    source_stat = source.stat()
+    if target.exists():
+        target_stat = target.stat()
+        if target_stat.st_size == source_stat.st_size and target_stat.st_mtime_ns == source_stat.st_mtime_ns:
+            return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, target)
+    return True
+
+
+def preprocess(source_dir, output_dir, workers, boilerplate_share=0.3, boilerplate_min_docs=5,
+               threshold=0.8, report_path=REPORT_FILE):
+    started = time.perf_counter()
+    source_dir, output_dir = Path(source_dir), Path(output_dir)
+    scanned = scan_source_files(source_dir, SOURCE_EXTENSIONS)
+    text_files = {
+        relative: file_path for relative, (file_path, _, _) in scanned.items()
+        if relative.lower().endswith(TEXT_EXTENSIONS)
+    }
+    print(f"Preprocessing {len(text_files)} text documents from {source_dir} with {workers} workers...")
+
+    chunksize = max(1, len(text_files) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Pass 1: count in how many documents each line appears
+        line_counts = Counter()
+        for keys in executor.map(line_keys, text_files.values(), chunksize=chunksize):
+            line_counts.update(keys)
+    min_docs = max(boilerplate_min_docs, boilerplate_share * len(text_files))
+    boilerplate = frozenset(key for key, count in line_counts.items() if count >= min_docs)
+    print(f"Boilerplate lines: {len(boilerplate)} (in at least {min_docs:.0f} documents)")
+
+    # Pass 2: strip the boilerplate and compute MinHash signatures
+    cleaned = {}
+    signatures = {}
+    original_bytes = 0
+    empty = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(boilerplate,)) as executor:
+        for relative, size, text, signature in executor.map(
+            clean_document, text_files.items(), chunksize=chunksize
+        ):
+            original_bytes += size
+            if signature is None:
+                empty.append(relative)
+                continue
+            cleaned[relative] = text
+            signatures[relative] = signature
+
+    sizes = {relative: len(text) for relative, text in cleaned.items()}
+    duplicates = find_duplicates(signatures, sizes, threshold)
+    collapsed = {relative for members in duplicates.values() for relative, _ in members}
+
+    # Write the kept documents, copy the other formats and remove outputs
+    # whose source is gone or was collapsed
+    written = 0
+    kept_bytes = 0
+    expected = set()
+    for relative, text in cleaned.items():
+        if relative in collapsed:
+            continue
+        data = text.encode('utf-8')
+        kept_bytes += len(data)
+        expected.add(relative)
+        written += write_if_changed(output_dir / relative, data)
+    for relative, (file_path, _, _) in scanned.items():
+        if relative not in text_files:
+            expected.add(relative)
+            written += copy_if_changed(file_path, output_dir / relative)
+    removed = 0
+    for relative, (file_path, _, _) in scan_source_files(output_dir, SOURCE_EXTENSIONS).items():
+        if relative not in expected:
+            file_path.unlink()
+            removed += 1
+
+    elapsed = time.perf_counter() - started
+    report = {
+        'source_dir': str(source_dir),
+        'output_dir': str(output_dir),
+        'text_documents': len(text_files),
+        'other_files': len(scanned) - len(text_files),
+        'boilerplate_lines': len(boilerplate),
+        'original_bytes': original_bytes,
+        'kept_bytes': kept_bytes,
+        'empty_after_stripping': sorted(empty),
+        'duplicates': [
+            {'kept': kept, 'collapsed': [{'path': relative, 'similarity': sim} for relative, sim in members]}
+            for kept, members in sorted(duplicates.items())
+        ],
+        'written': written,
+        'removed': removed,
+        'elapsed_seconds': round(elapsed, 2),
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"Near-duplicate groups: {len(duplicates)}, documents collapsed: {len(collapsed)}")
+    print(f"Empty after stripping: {len(empty)}")
+    print(f"Text size: {original_bytes / 1024:.0f} KiB -> {kept_bytes / 1024:.0f} KiB")
+    print(f"Written: {written}, removed from {output_dir}: {removed}")
+    print(f"Finished in {elapsed:.1f}s, report saved to {report_path}")
+    return report
+
+
+def main():
+    args = parse_args()
+    preprocess(
+        args.source_dir, args.output_dir, args.workers,
+        args.boilerplate_share, args.boilerplate_min_docs, args.similarity, args.report
+    )
+
+
+if __name__ == '__main__':
+    main()
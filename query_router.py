@@ -0,0 +1,169 @@
+import datetime
+import json
+import re
+import unicodedata
+
+from google.genai import types
+
+# Years the article export covers
+MIN_YEAR = 1990
+
+YEAR_RANGE_PATTERN = re.compile(r'\b((?:19|20)\d{2})\s*(?:-|–|až|do)\s*((?:19|20)\d{2})\b')
+YEAR_PATTERN = re.compile(r'\b((?:19|20)\d{2})\b')
+
+# Words matched against the question without diacritics, from the start
+# of a word, so "kolonie" is not "loni" and "výroční zpráva" is not news
+NEWS_PATTERN = re.compile(r'\b((?<!vyrocni )(?<!vyrocnich )zprav(y|ach|ami|am)?\b|zpravodajstv|aktualit|novink|tiskov|patran|pohresova)')
+ARCHIVE_PATTERN = re.compile(r'\barchiv')
+THIS_YEAR_PATTERN = re.compile(r'\b(letos|letosn\w*|tento rok|tomto roce)\b')
+LAST_YEAR_PATTERN = re.compile(r'\b(loni|lonsk\w*|minuly rok|minulem roce|predchozi rok|predchozim roce)\b')
+
+# Questions with these words may contain a time constraint the rules did
+# not understand; only those are sent to the routing model
+TIME_HINT_PATTERN = re.compile(r'\b(?:rok|roce|roku|letech|obdob\w*|mesic\w*|posledni\w*|nedavn\w*)\b')
+
+ROUTER_PROMPT = """Z otázky uživatele urči omezení pro vyhledávání v článcích webu Policie ČR.
+Dnešní datum je {today}.
+Vrať year_from a year_to (roky, kterých se otázka týká, nebo null), news (true, pokud se
+ptá na zprávy nebo aktuality, jinak null) a include_archive (true, pokud chce i archivní články).
+
+Otázka: {question}"""
+
+
+def fold(text):
+    # Lowercase the text and strip Czech diacritics for keyword matching
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+class Route:
+    """Metadata constraints derived from a question."""
+
+    def __init__(self, year_from=None, year_to=None, news=None, include_archive=False, source='rules'):
+        self.year_from = year_from
+        self.year_to = year_to
+        self.news = news
+        self.include_archive = include_archive
+        self.source = source
+
+    def __repr__(self):
+        return (f"Route(year_from={self.year_from}, year_to={self.year_to}, news={self.news}, "
+                f"include_archive={self.include_archive}, source={self.source!r})")
+
+    def metadata_filter(self, exclude_archive=True):
+        # Build a File Search metadata_filter expression (AIP-160 syntax)
+        clauses = []
+        if self.year_from is not None and self.year_from == self.year_to:
+            clauses.append(f"article_year = {self.year_from}")
+        else:
+            if self.year_from is not None:
+                clauses.append(f"article_year >= {self.year_from}")
+            if self.year_to is not None:
+                clauses.append(f"article_year <= {self.year_to}")
+        if self.news:
+            clauses.append("is_news = 1")
+        if exclude_archive and not self.include_archive:
+            # Documents uploaded without metadata have no is_archived key,
+            # which `is_archived = 0` would leave out
+            clauses.append("NOT is_archived = 1")
+        return " AND ".join(clauses) or None
+
+    @property
+    def narrowed(self):
+        # Whether the route limits the search by year or to news, beyond
+        # the archive exclusion
+        return self.year_from is not None or self.year_to is not None or bool(self.news)
+
+    def widened(self):
+        # The same route without the year and news constraints, for asking
+        # again when nothing matched; the archive decision is kept
+        return Route(include_archive=self.include_archive, source=self.source)
+
+
+def _valid_year(year, today):
+    return year is not None and MIN_YEAR <= year <= today.year
+
+
+def route_by_rules(question, today=None):
+    """Return (route, needs_model) for a question using keyword rules only.
+
+    `needs_model` is True when the question looks like it names a time
+    period that the rules could not resolve.
+    """
+    today = today or datetime.date.today()
+    folded = fold(question)
+    route = Route()
+
+    match = YEAR_RANGE_PATTERN.search(folded)
+    if match:
+        first, last = sorted((int(match.group(1)), int(match.group(2))))
+        route.year_from, route.year_to = first, last
+    else:
+        years = sorted({int(year) for year in YEAR_PATTERN.findall(folded)})
+        if years:
+            route.year_from, route.year_to = years[0], years[-1]
+        elif THIS_YEAR_PATTERN.search(folded):
+            route.year_from = route.year_to = today.year
+        elif LAST_YEAR_PATTERN.search(folded):
+            route.year_from = route.year_to = today.year - 1
+
+    if not (_valid_year(route.year_from, today) and _valid_year(route.year_to, today)):
+        route.year_from = route.year_to = None
+
+    if NEWS_PATTERN.search(folded):
+        route.news = True
+    if ARCHIVE_PATTERN.search(folded):
+        route.include_archive = True
+
+    needs_model = route.year_from is None and bool(TIME_HINT_PATTERN.search(folded))
+    return route, needs_model
+
+
+def route_with_model(client, model, question, today=None):
+    today = today or datetime.date.today()
+    response = client.models.generate_content(
+        model=model,
+        contents=ROUTER_PROMPT.format(today=today.isoformat(), question=question),
+        config=types.GenerateContentConfig(
+            temperature=0.0,
+            response_mime_type='application/json',
+            response_schema={
+                'type': 'OBJECT',
+                'properties': {
+                    'year_from': {'type': 'INTEGER', 'nullable': True},
+                    'year_to': {'type': 'INTEGER', 'nullable': True},
+                    'news': {'type': 'BOOLEAN', 'nullable': True},
+                    'include_archive': {'type': 'BOOLEAN', 'nullable': True},
+                },
+            },
+        ),
+    )
+    data = json.loads(response.text)
+    route = Route(
+        year_from=data.get('year_from'),
+        year_to=data.get('year_to'),
+        news=data.get('news') or None,
+        include_archive=bool(data.get('include_archive')),
+        source='model',
+    )
+    if not (_valid_year(route.year_from, today) or route.year_from is None):
+        route.year_from = None
+    if not (_valid_year(route.year_to, today) or route.year_to is None):
+        route.year_to = None
+    return route
+
+
+def route_question(question, client=None, model=None):
+    # Rules first; the cheap model is only asked when the rules found a
+    # hint of a time constraint they could not resolve
+    route, needs_model = route_by_rules(question)
+    if needs_model and client is not None and model:
+        try:
+            model_route = route_with_model(client, model, question)
+        except Exception:
+            return route
+        # Keep what the rules already found
+        model_route.news = route.news or model_route.news
+        model_route.include_archive = route.include_archive or model_route.include_archive
+        return model_route
+    return route
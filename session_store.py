@@ -0,0 +1,206 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from chat_core import source_url
+
+SESSION_DB = 'chat_sessions.db'
+
+
+class SessionStore:
+    """Conversations persisted in SQLite, one row per message.
+
+    Sources are stored as a JSON list of document titles; links are rebuilt
+    with `source_url` when the messages are loaded. Messages are numbered
+    by `seq` from 0, so the seq of a message is the number of messages
+    before it.
+    """
+
+    def __init__(self, path=SESSION_DB):
+        # Shared by the Streamlit script threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                sources TEXT,
+                error INTEGER NOT NULL DEFAULT 0,
+                lookup INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (session_id, seq)
+            );
+        ''')
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(messages)')}
+        if 'lookup' not in columns:
+            # Databases from before document lookups were flagged
+            self.connection.execute('ALTER TABLE messages ADD COLUMN lookup INTEGER NOT NULL DEFAULT 0')
+            self.connection.execute(
+                "UPDATE messages SET lookup = 1 WHERE role = 'assistant' AND content LIKE 'Nalezené dokumenty:%'"
+            )
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def create_session(self):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO sessions (session_id, created_at, updated_at) VALUES (?, ?, ?)',
+                (session_id, now, now)
+            )
+        return session_id
+
+    def exists(self, session_id):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone() is not None
+
+    def add_message(self, session_id, role, content, sources=None, error=False, lookup=False):
+        titles = json.dumps([source['title'] for source in sources], ensure_ascii=False) if sources else None
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO messages (session_id, seq, role, content, sources, error, lookup) '
+                'SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ?, ?, ?, ? FROM messages WHERE session_id = ?',
+                (session_id, role, content, titles, int(error), int(lookup), session_id)
+            )
+            self.connection.execute(
+                'UPDATE sessions SET updated_at = ? WHERE session_id = ?', (time.time(), session_id)
+            )
+
+    def messages(self, session_id):
+        # All messages in the format of st.session_state.messages
+        return self._messages(session_id, 0, None)
+
+    def page(self, session_id, questions, before=None):
+        # The messages of the last `questions` questions before seq `before`
+        # (the end of the conversation when None), with the seq of the
+        # first one; a long conversation is shown page by page
+        query = "SELECT seq FROM messages WHERE session_id = ? AND role = 'user'"
+        params = [session_id]
+        if before is not None:
+            query += ' AND seq < ?'
+            params.append(before)
+        with self.lock:
+            row = self.connection.execute(
+                query + ' ORDER BY seq DESC LIMIT 1 OFFSET ?', params + [questions - 1]
+            ).fetchone()
+        start = row[0] if row else 0
+        return self._messages(session_id, start, before), start
+
+    def _messages(self, session_id, start, before):
+        query = 'SELECT role, content, sources, error, lookup FROM messages WHERE session_id = ? AND seq >= ?'
+        params = [session_id, start]
+        if before is not None:
+            query += ' AND seq < ?'
+            params.append(before)
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY seq', params).fetchall()
+        messages = []
+        for role, content, sources, error, lookup in rows:
+            message = {"role": role, "content": content}
+            if sources is not None:
+                message["sources"] = [{'title': title, 'url': source_url(title)} for title in json.loads(sources)]
+            if error:
+                message["error"] = True
+            if lookup:
+                message["lookup"] = True
+            messages.append(message)
+        return messages
+
+    def delete(self, session_id):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def purge(self, max_age):
+        # Delete conversations not updated for max_age seconds
+        with self.lock, self.connection:
+            return self.connection.execute(
+                'DELETE FROM sessions WHERE updated_at < ?', (time.time() - max_age,)
+            ).rowcount
+
+
+def history_turns(messages):
+    # Answered turns as [{"role": "user"|"model", "text": ...}] for
+    # text_history; failed questions and document lookups, answered
+    # without the model, are left out, as in the live chat
+    turns = []
+    for question, answer in zip(messages, messages[1:]):
+        if (question["role"] == "user" and answer["role"] == "assistant"
+                and not answer.get("error") and not answer.get("lookup")):
+            turns.append({"role": "user", "text": question["content"]})
+            turns.append({"role": "model", "text": answer["content"]})
+    return turns
+
+
+class SessionPool:
+    """Live chat sessions kept in memory, least recently used first out.
+
+    Sessions idle for longer than `idle_ttl` seconds are dropped, and so are
+    the least recently used ones while the histories together exceed
+    `max_tokens`. Dropped sessions are rebuilt from the SessionStore.
+    """
+
+    def __init__(self, idle_ttl=1800, max_tokens=2_000_000):
+        self.idle_ttl = idle_ttl
+        self.max_tokens = max_tokens
+        self._sessions = OrderedDict()  # session_id -> (value, tokens, last_used)
+        self._tokens = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            value, tokens, _ = entry
+            self._sessions[session_id] = (value, tokens, time.monotonic())
+            self._sessions.move_to_end(session_id)
+            return value
+
+    def put(self, session_id, value, tokens):
+        # Add or update a session; tokens is the estimated size of its history
+        with self._lock:
+            self._discard(session_id)
+            self._sessions[session_id] = (value, tokens, time.monotonic())
+            self._tokens += tokens
+            self._evict(keep=session_id)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._discard(session_id)
+
+    def _discard(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._tokens -= entry[1]
+
+    def _evict(self, keep):
+        deadline = time.monotonic() - self.idle_ttl
+        for session_id, (_, tokens, last_used) in list(self._sessions.items()):
+            if session_id == keep:
+                continue
+            if last_used >= deadline and self._tokens <= self.max_tokens:
+                # Ordered by last use, so the rest is newer
+                break
+            self._discard(session_id)
+            self.evictions += 1
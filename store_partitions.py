@@ -0,0 +1,136 @@
+import json
+import os
+
+# Partition -> File Search store mapping, written by
+# upload_file_search_store.py --partition
+PARTITIONS_FILE = 'file_search_stores.json'
+
+# Years starting a new partition: ..2019, 2020-2022, 2023..
+DEFAULT_YEAR_BOUNDS = (2020, 2023)
+
+
+def year_ranges(year_bounds):
+    # [(year_from, year_to)] covering all years, None meaning open-ended
+    bounds = sorted(year_bounds)
+    starts = [None] + bounds
+    ends = [bound - 1 for bound in bounds] + [None]
+    return list(zip(starts, ends))
+
+
+def range_label(year_from, year_to):
+    if year_from is None:
+        return f"to-{year_to}"
+    if year_to is None:
+        return f"from-{year_from}"
+    return f"{year_from}-{year_to}"
+
+
+class Partition:
+    """One File Search store holding the documents of one metadata slice.
+
+    Archived documents share one partition. The rest are split into news
+    and other pages, and then by article_year range, with an `undated`
+    partition for documents without a year.
+    """
+
+    def __init__(self, partition_id, store_name=None, archived=False, news=False, dated=False,
+                 year_from=None, year_to=None):
+        self.id = partition_id
+        self.store_name = store_name
+        self.archived = archived
+        self.news = news
+        self.dated = dated
+        self.year_from = year_from
+        self.year_to = year_to
+
+    def as_dict(self):
+        return {
+            'store': self.store_name,
+            'archived': self.archived,
+            'news': self.news,
+            'dated': self.dated,
+            'year_from': self.year_from,
+            'year_to': self.year_to,
+        }
+
+    def matches(self, route, exclude_archive=True):
+        # Whether documents matching the route's metadata_filter can be in
+        # this partition
+        if self.archived:
+            return route.include_archive or not exclude_archive
+        if route.news and not self.news:
+            return False
+        if route.year_from is not None or route.year_to is not None:
+            if not self.dated:
+                return False
+            if route.year_from is not None and self.year_to is not None and self.year_to < route.year_from:
+                return False
+            if route.year_to is not None and self.year_from is not None and self.year_from > route.year_to:
+                return False
+        return True
+
+
+def partition_for(custom_metadata, year_bounds=DEFAULT_YEAR_BOUNDS):
+    # Partition of a document from its MetadataIndex entry
+    fields = {item.key: item.numeric_value for item in custom_metadata or () if item.numeric_value is not None}
+    if fields.get('is_archived') == 1:
+        return Partition('archive', archived=True)
+    news = fields.get('is_news') == 1
+    kind = 'news' if news else 'pages'
+    year = fields.get('article_year')
+    if year is None:
+        return Partition(f"{kind}-undated", news=news)
+    for year_from, year_to in year_ranges(year_bounds):
+        if (year_from is None or year >= year_from) and (year_to is None or year <= year_to):
+            return Partition(
+                f"{kind}-{range_label(year_from, year_to)}", news=news, dated=True,
+                year_from=year_from, year_to=year_to
+            )
+
+
+class StorePartitions:
+    """The partitioned store layout recorded in PARTITIONS_FILE."""
+
+    def __init__(self, year_bounds=DEFAULT_YEAR_BOUNDS, partitions=None):
+        self.year_bounds = tuple(year_bounds)
+        self.partitions = partitions or {}  # id -> Partition
+
+    def __len__(self):
+        return len(self.partitions)
+
+    @classmethod
+    def load(cls, path=PARTITIONS_FILE):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        partitions = {
+            partition_id: Partition(
+                partition_id, entry['store'], entry['archived'], entry['news'], entry['dated'],
+                entry['year_from'], entry['year_to']
+            )
+            for partition_id, entry in data['partitions'].items()
+        }
+        return cls(data['year_bounds'], partitions)
+
+    def save(self, path=PARTITIONS_FILE):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'year_bounds': list(self.year_bounds),
+                'partitions': {
+                    partition_id: partition.as_dict()
+                    for partition_id, partition in sorted(self.partitions.items())
+                },
+            }, f, indent=2)
+        os.replace(temporary_path, path)
+
+    def store_names(self):
+        return [partition.store_name for _, partition in sorted(self.partitions.items())]
+
+    def select(self, route, exclude_archive=True):
+        # Stores to search for a routed question; all of them when no
+        # partition matches, so the metadata_filter still decides
+        selected = [
+            partition.store_name for _, partition in sorted(self.partitions.items())
+            if partition.matches(route, exclude_archive)
+        ]
+        return selected or self.store_names()
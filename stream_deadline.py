@@ -0,0 +1,157 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+
+
+class AnswerTimeout(Exception):
+    """The model missed the time-to-first-token or the total deadline."""
+
+
+class AnswerCancelled(Exception):
+    """A newer question in the same conversation replaced this answer."""
+
+
+class Deadline:
+    """Time-to-first-token and total deadlines of one answer.
+
+    `first_token` seconds apply to each model call until its first text
+    arrives, `total` seconds to the whole answer counted from `started`;
+    None disables either. `cancelled()` is polled every `poll_interval`
+    seconds while waiting for a chunk and stops the answer once it returns
+    true.
+    """
+
+    def __init__(self, first_token=None, total=None, cancelled=None, started=None, poll_interval=0.5):
+        self.first_token = first_token
+        self.total = total
+        self.cancelled = cancelled
+        self.started = time.perf_counter() if started is None else started
+        self.poll_interval = poll_interval
+
+    def check(self, call_started, text_seen):
+        # Seconds to wait for the next chunk before checking again; raises
+        # once the answer is cancelled or a deadline has passed
+        if self.cancelled and self.cancelled():
+            raise AnswerCancelled("A newer question replaced this answer")
+        now = time.perf_counter()
+        wait = self.poll_interval
+        if self.total is not None:
+            remaining = self.started + self.total - now
+            if remaining <= 0:
+                raise AnswerTimeout(f"No complete answer within {self.total:g}s")
+            wait = min(wait, remaining)
+        if self.first_token is not None and not text_seen:
+            remaining = call_started + self.first_token - now
+            if remaining <= 0:
+                raise AnswerTimeout(f"No answer text within {self.first_token:g}s")
+            wait = min(wait, remaining)
+        return wait
+
+    def iterate(self, stream, on_wait=None):
+        # Yield the chunks of a blocking stream. The stream is read in a
+        # worker thread, so a stuck call cannot hold the caller past the
+        # deadlines; on_wait() is called whenever no chunk has arrived
+        # within the poll interval. Once the caller stops, the worker
+        # closes the stream at its next chunk.
+        chunks = queue.Queue()
+        stop = threading.Event()
+
+        def read():
+            try:
+                for chunk in stream:
+                    chunks.put((chunk, None))
+                    if stop.is_set():
+                        break
+                chunks.put((None, None))
+            except Exception as e:
+                chunks.put((None, e))
+            finally:
+                stream.close()
+
+        call_started = time.perf_counter()
+        text_seen = False
+        threading.Thread(target=read, name='answer-stream', daemon=True).start()
+        try:
+            while True:
+                try:
+                    chunk, error = chunks.get(timeout=self.check(call_started, text_seen))
+                except queue.Empty:
+                    if on_wait:
+                        on_wait()
+                    continue
+                if error:
+                    raise error
+                if chunk is None:
+                    return
+                text_seen = text_seen or bool(chunk.text)
+                yield chunk
+        finally:
+            stop.set()
+
+    async def iterate_async(self, open_stream):
+        # Async counterpart of iterate(); open_stream is the awaitable
+        # returning the stream, as from AsyncChat.send_message_stream.
+        # Stopping cancels the pending read, which closes the connection.
+        call_started = time.perf_counter()
+        text_seen = False
+        stream = None
+        pending = asyncio.ensure_future(open_stream)
+        try:
+            while True:
+                while not pending.done():
+                    await asyncio.wait({pending}, timeout=self.check(call_started, text_seen))
+                if stream is None:
+                    stream = pending.result()
+                else:
+                    try:
+                        chunk = pending.result()
+                    except StopAsyncIteration:
+                        return
+                    text_seen = text_seen or bool(chunk.text)
+                    yield chunk
+                pending = asyncio.ensure_future(anext(stream))
+        finally:
+            if not pending.done():
+                pending.cancel()
+                await asyncio.wait({pending})
+            if not pending.cancelled():
+                pending.exception()
+            if stream is not None:
+                await stream.aclose()
+
+
+class ActiveTurns:
+    """The latest question of each conversation.
+
+    Every question takes a ticket; an answer whose ticket is no longer the
+    latest of its conversation has been superseded and should stop. A
+    conversation is forgotten once none of its answers is running.
+    """
+
+    def __init__(self):
+        self._turns = {}  # conversation -> [latest ticket, running answers]
+        self._tickets = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, key):
+        with self._lock:
+            ticket = next(self._tickets)
+            turns = self._turns.setdefault(key, [ticket, 0])
+            turns[0] = ticket
+            turns[1] += 1
+        return ticket
+
+    def superseded(self, key, ticket):
+        with self._lock:
+            turns = self._turns.get(key)
+            return turns is not None and turns[0] != ticket
+
+    def finish(self, key):
+        with self._lock:
+            turns = self._turns.get(key)
+            if turns is not None:
+                turns[1] -= 1
+                if not turns[1]:
+                    del self._turns[key]
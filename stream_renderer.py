@@ -0,0 +1,68 @@
+import time
+
+
+class StreamRenderer:
+    """Buffers streamed text and redraws a Streamlit placeholder sparingly.
+
+    Re-rendering the whole answer on every chunk costs O(n^2) in answer
+    length and sends a websocket message per chunk. Chunks are collected in
+    a list and the placeholder is only redrawn once `flush_interval` seconds
+    have passed or `flush_chars` characters have arrived since the last
+    redraw.
+    """
+
+    def __init__(self, placeholder, flush_interval=0.15, flush_chars=500, cursor="▌"):
+        self.placeholder = placeholder
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.cursor = cursor
+
+        self._parts = []
+        self._text = ""
+        self._pending_chars = 0
+        self._last_flush = time.perf_counter()
+
+        self.started = time.perf_counter()
+        self.time_to_first_token = None
+        self.chunks = 0
+        self.flushes = 0
+
+    @property
+    def text(self):
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts = []
+        return self._text
+
+    def write(self, text):
+        if not text:
+            return
+        now = time.perf_counter()
+        if self.time_to_first_token is None:
+            self.time_to_first_token = now - self.started
+        self.chunks += 1
+        self._parts.append(text)
+        self._pending_chars += len(text)
+
+        if (self._pending_chars >= self.flush_chars
+                or now - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if not self._pending_chars:
+            return
+        self.placeholder.markdown(self.text + self.cursor)
+        self._pending_chars = 0
+        self._last_flush = time.perf_counter()
+        self.flushes += 1
+
+    def wait(self):
+        # Redraw while no chunk arrives, so the cursor shows before the
+        # first token; each redraw also lets Streamlit stop the run when
+        # the user sends a newer question
+        self.placeholder.markdown(self.text + self.cursor)
+
+    def finish(self):
+        # Draw the complete answer without the cursor
+        self.placeholder.markdown(self.text)
+        return self.text
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Local manifest of what has been uploaded to the File Search store
+MANIFEST_FILE = 'upload_manifest.db'
+
+# File types picked up from source_files
+SOURCE_EXTENSIONS = ('.md', '.txt', '.pdf', '.doc', '.docx')
+
+
+def scan_source_files(source_dir, extensions=SOURCE_EXTENSIONS):
+    # Walk the source tree once and stat every matching file.
+    # Returns {relative posix path: (Path, size, mtime_ns)}.
+    source_dir = Path(source_dir)
+    scanned = {}
+    for root, _, filenames in os.walk(source_dir):
+        for filename in filenames:
+            if not filename.lower().endswith(extensions):
+                continue
+            file_path = Path(root) / filename
+            stat = file_path.stat()
+            relative = file_path.relative_to(source_dir).as_posix()
+            scanned[relative] = (file_path, stat.st_size, stat.st_mtime_ns)
+    return scanned
+
+
+def write_if_changed(path, data):
+    # Leave unchanged outputs alone so the upload manifest sees no change.
+    # Returns whether the file was written.
+    if path.exists() and path.stat().st_size == len(data) and path.read_bytes() == data:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return True
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SyncPlan:
+    def __init__(self):
+        self.new = []          # [(relative, Path, size, mtime_ns, sha256)]
+        self.modified = []     # [(relative, Path, size, mtime_ns, sha256)]
+        self.unchanged = []    # [relative]
+        self.touched = []      # [(relative, size, mtime_ns)] same content, new stat
+        self.deleted = []      # [(relative, document_name)]
+
+
+def compute_sync_plan(scanned, entries, workers=8):
+    # Compare the scanned tree with the manifest. Files whose size and mtime
+    # match the manifest are trusted without hashing; everything else is
+    # hashed (in parallel) to tell real edits apart from touched files.
+    plan = SyncPlan()
+    to_hash = []
+    for relative, (file_path, size, mtime_ns) in scanned.items():
+        entry = entries.get(relative)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            plan.unchanged.append(relative)
+        else:
+            to_hash.append(relative)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash') as executor:
+        hashes = executor.map(hash_file, [scanned[relative][0] for relative in to_hash])
+        for relative, sha256 in zip(to_hash, hashes):
+            file_path, size, mtime_ns = scanned[relative]
+            entry = entries.get(relative)
+            if entry is None:
+                plan.new.append((relative, file_path, size, mtime_ns, sha256))
+            elif entry['sha256'] == sha256:
+                plan.unchanged.append(relative)
+                plan.touched.append((relative, size, mtime_ns))
+            else:
+                plan.modified.append((relative, file_path, size, mtime_ns, sha256))
+
+    for relative, entry in entries.items():
+        if relative not in scanned:
+            plan.deleted.append((relative, entry['document_name']))
+
+    return plan
+
+
+class Manifest:
+    """SQLite-backed map of source path -> content hash, stat and document name.
+
+    Imports whose outcome is not known yet are kept in `operations`, so a
+    later attempt or run polls them again instead of uploading the file a
+    second time. The manifest belongs to a single File Search store; binding
+    it to a different store clears it.
+    """
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                document_name TEXT NOT NULL,
+                uploaded_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS operations (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                operation_name TEXT NOT NULL
+            );
+        ''')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def bind_store(self, store_name):
+        # Returns False when the manifest was empty or described another store
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE key = 'store_name'"
+        ).fetchone()
+        if row and row[0] == store_name:
+            # An empty manifest adopts the store's documents again, but
+            # keeps the imports it is still waiting for
+            return len(self) > 0
+        with self.connection:
+            self.connection.execute('DELETE FROM files')
+            self.connection.execute('DELETE FROM operations')
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('store_name', ?)",
+                (store_name,)
+            )
+        return False
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def entries(self):
+        return {
+            path: {'sha256': sha256, 'size': size, 'mtime_ns': mtime_ns, 'document_name': document_name}
+            for path, sha256, size, mtime_ns, document_name in self.connection.execute(
+                'SELECT path, sha256, size, mtime_ns, document_name FROM files'
+            )
+        }
+
+    def record(self, relative, sha256, size, mtime_ns, document_name):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (path, sha256, size, mtime_ns, document_name, uploaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (relative, sha256, size, mtime_ns, document_name, time.time())
+            )
+            self.connection.execute('DELETE FROM operations WHERE path = ?', (relative,))
+
+    def touch(self, touched):
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?',
+                [(size, mtime_ns, relative) for relative, size, mtime_ns in touched]
+            )
+
+    def remove(self, relative):
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (relative,))
+
+    def operations(self):
+        # path -> (sha256, operation name) of imports not known to be done
+        return {
+            path: (sha256, operation_name)
+            for path, sha256, operation_name in self.connection.execute(
+                'SELECT path, sha256, operation_name FROM operations'
+            )
+        }
+
+    def save_operation(self, relative, sha256, operation_name):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO operations (path, sha256, operation_name) VALUES (?, ?, ?)',
+                (relative, sha256, operation_name)
+            )
+
+    def remove_operation(self, relative):
+        with self.connection:
+            self.connection.execute('DELETE FROM operations WHERE path = ?', (relative,))
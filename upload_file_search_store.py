@@ -1,38 +1,153 @@
 from google import genai
 from google.genai import types
+import argparse
 import time
 import os
-import csv
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
-# Initialize the Gemini API client
-client = genai.Client(api_key='***REMOVED***')
+from convert_documents import CONVERTED_DIR, convert
+from gemini_client import BULK, RateLimitedClient, RateLimiter
+from metadata_index import METADATA_CACHE, METADATA_CSV, MetadataIndex, load_metadata_index
+from operation_tracker import OperationTracker
+from preprocess_sources import PROCESSED_DIR, REPORT_FILE, preprocess
+from store_partitions import DEFAULT_YEAR_BOUNDS, PARTITIONS_FILE, StorePartitions, partition_for
+from sync_manifest import MANIFEST_FILE, Manifest, compute_sync_plan, hash_file, scan_source_files
 
 # File to store the file search store name
 STORE_NAME_FILE = 'file_search_store_name.txt'
 
-# Check if file search store already exists
-if os.path.exists(STORE_NAME_FILE):
-    with open(STORE_NAME_FILE, 'r') as f:
-        store_name = f.read().strip()
-    
+# Directory with the documents to upload
+SOURCE_DIR = Path('source_files')
+
+# Default size of the upload worker pool
+DEFAULT_WORKERS = 8
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Upload source_files into the Gemini File Search store."
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f"Number of parallel upload workers (default: {DEFAULT_WORKERS}, 1 = sequential)"
+    )
+    parser.add_argument(
+        '--max-in-flight', type=int, default=None,
+        help="Maximum number of uploads submitted but not yet finished (default: 2 x workers)"
+    )
+    parser.add_argument(
+        '--poll-rate', type=float, default=10.0,
+        help="Maximum number of operation status polls per second across all uploads (default: 10)"
+    )
+    parser.add_argument(
+        '--max-retries', type=int, default=2,
+        help="How many times to re-upload files whose upload or import failed (default: 2)"
+    )
+    parser.add_argument(
+        '--requests-per-minute', type=int, default=None,
+        help="Requests per minute the upload may use; keep it below the key's quota when the chat shares the key (default: no limit)"
+    )
+    parser.add_argument(
+        '--api-retries', type=int, default=4,
+        help="How many times to retry an API call failing with 429 or a server error (default: 4)"
+    )
+    parser.add_argument(
+        '--keep-orphans', action='store_true',
+        help="Do not delete documents whose source file was removed"
+    )
+    parser.add_argument(
+        '--rebuild-manifest', action='store_true',
+        help=f"Re-list the store and adopt its documents into {MANIFEST_FILE}"
+    )
+    parser.add_argument(
+        '--no-metadata-cache', action='store_true',
+        help=f"Always parse {METADATA_CSV} instead of using {METADATA_CACHE}"
+    )
+    parser.add_argument(
+        '--convert', action='store_true',
+        help=f"Convert PDF/DOC/DOCX to Markdown into {CONVERTED_DIR} and upload the Markdown where the text is usable"
+    )
+    parser.add_argument(
+        '--preprocess', action='store_true',
+        help=f"Strip boilerplate and drop near-duplicates into {PROCESSED_DIR} and upload from there (report: {REPORT_FILE})"
+    )
+    parser.add_argument(
+        '--preprocess-workers', type=int, default=os.cpu_count() or 1,
+        help="Number of processes for --convert and --preprocess (default: number of CPUs)"
+    )
+    parser.add_argument(
+        '--partition', action='store_true',
+        help=f"Split documents into one store per archive status, news flag and year range, recorded in {PARTITIONS_FILE}"
+    )
+    parser.add_argument(
+        '--partition-years', default=','.join(map(str, DEFAULT_YEAR_BOUNDS)),
+        help="Years starting a new year range (default: %(default)s)"
+    )
+    parser.add_argument(
+        '--only-partition', action='append', default=[],
+        help="With --partition, sync only this partition, e.g. news-from-2023 (repeatable)"
+    )
+    args = parser.parse_args(argv)
     try:
-        # Try to get the existing store
-        file_search_store = client.file_search_stores.get(name=store_name)
-        print(f"Using existing File Search store: {file_search_store.name}")
-        print(f"Display Name: {file_search_store.display_name}")
-    except Exception as e:
-        print(f"Could not find existing store '{store_name}', creating new one...")
-        file_search_store = client.file_search_stores.create(
-            config={'display_name': 'mvcr-ai-docs'}
-        )
-        print(f"File Search store created: {file_search_store.name}")
-        # Save the store name
-        with open(STORE_NAME_FILE, 'w') as f:
-            f.write(file_search_store.name)
-else:
-    # Create new File Search store
-    print("Creating File Search store 'mvcr-ai-docs'...")
+        args.partition_years = tuple(int(year) for year in args.partition_years.split(',') if year.strip())
+    except ValueError:
+        parser.error("--partition-years must be a comma-separated list of years")
+    if args.only_partition and not args.partition:
+        parser.error("--only-partition requires --partition")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.preprocess_workers < 1:
+        parser.error("--preprocess-workers must be at least 1")
+    if args.max_in_flight is None:
+        args.max_in_flight = args.workers * 2
+    if args.max_in_flight < args.workers:
+        parser.error("--max-in-flight must be at least --workers")
+    if args.poll_rate <= 0:
+        parser.error("--poll-rate must be positive")
+    if args.max_retries < 0:
+        parser.error("--max-retries must not be negative")
+    if args.api_retries < 0:
+        parser.error("--api-retries must not be negative")
+    if args.requests_per_minute is not None and args.requests_per_minute < 1:
+        parser.error("--requests-per-minute must be positive")
+    return args
+
+
+def get_or_create_partition_store(client, partition):
+    # Store of one partition, created on first use
+    display_name = f"mvcr-ai-docs-{partition.id}"
+    if partition.store_name:
+        try:
+            file_search_store = client.file_search_stores.get(name=partition.store_name)
+            print(f"Using existing File Search store: {file_search_store.name} ({display_name})")
+            return file_search_store
+        except Exception as e:
+            print(f"Could not find existing store '{partition.store_name}' ({e}), creating new one...")
+
+    file_search_store = client.file_search_stores.create(config={'display_name': display_name})
+    print(f"File Search store created: {file_search_store.name} ({display_name})")
+    partition.store_name = file_search_store.name
+    return file_search_store
+
+
+def get_or_create_store(client):
+    # Check if file search store already exists
+    if os.path.exists(STORE_NAME_FILE):
+        with open(STORE_NAME_FILE, 'r') as f:
+            store_name = f.read().strip()
+
+        try:
+            # Try to get the existing store
+            file_search_store = client.file_search_stores.get(name=store_name)
+            print(f"Using existing File Search store: {file_search_store.name}")
+            print(f"Display Name: {file_search_store.display_name}")
+            return file_search_store
+        except Exception as e:
+            print(f"Could not find existing store '{store_name}', creating new one...")
+    else:
+        print("Creating File Search store 'mvcr-ai-docs'...")
+
     file_search_store = client.file_search_stores.create(
         config={'display_name': 'mvcr-ai-docs'}
     )
@@ -40,182 +155,345 @@ else:
     # Save the store name for future runs
     with open(STORE_NAME_FILE, 'w') as f:
         f.write(file_search_store.name)
+    return file_search_store
 
-# Load metadata from CSV
-print("\nLoading metadata from files_metadata.csv...")
-metadata_by_filename = {}
-try:
-    # Use utf-8-sig to handle BOM if present
-    with open('files_metadata.csv', 'r', encoding='utf-8-sig') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=';')
-        for row in reader:
-            filename = row.get('article_filename', '').strip()
-            if filename and filename != 'NULL':
-                # Store metadata with both the base filename and common extensions
-                metadata = {
-                    'article_name': row.get('article_name', '').strip(),
-                    'is_archived': row.get('is_archived', '').strip(),
-                    'is_news': row.get('is_news', '').strip(),
-                    'article_year': row.get('article_year', '').strip()
-                }
-                # Store with base filename and common extensions
-                metadata_by_filename[filename] = metadata
-                metadata_by_filename[f"{filename}.md"] = metadata
-                metadata_by_filename[f"{filename}.txt"] = metadata
-                metadata_by_filename[f"{filename}.pdf"] = metadata
-    
-    # Count unique base filenames (divide by number of extensions we add)
-    unique_count = len([k for k in metadata_by_filename.keys() if not any(k.endswith(ext) for ext in ['.md', '.txt', '.pdf'])])
-    print(f"Loaded metadata for {unique_count} files")
-except Exception as e:
-    print(f"Warning: Could not load metadata CSV: {e}")
-    print("Continuing without metadata...")
-
-# Get list of already uploaded documents
-print("\nFetching existing documents from file search store...")
-existing_documents = {}
-try:
-    for document in client.file_search_stores.documents.list(
-        parent=file_search_store.name
-    ):
-        existing_documents[document.display_name] = document.name
-    print(f"Found {len(existing_documents)} existing documents")
-except Exception as e:
-    print(f"Note: Could not fetch existing documents: {e}")
-
-# Define the source files directory
-source_dir = Path('source_files')
-
-# Get all files recursively from source_files directory
-all_files = []
-for ext in ['*.md', '*.txt', '*.pdf', '*.doc', '*.docx']:
-    all_files.extend(source_dir.rglob(ext))
-
-# Filter out files that are already uploaded
-files_to_upload = []
-skipped_files = []
-for file_path in all_files:
-    if file_path.name in existing_documents:
-        skipped_files.append(file_path.name)
-    else:
-        files_to_upload.append(file_path)
 
-print(f"\nFound {len(all_files)} total files")
-print(f"Already uploaded: {len(skipped_files)}")
-print(f"New files to upload: {len(files_to_upload)}")
+def load_metadata(args):
+    # Load metadata from CSV
+    print(f"\nLoading metadata from {METADATA_CSV}...")
+    try:
+        metadata_index, from_cache = load_metadata_index(
+            METADATA_CSV, None if args.no_metadata_cache else METADATA_CACHE
+        )
+    except Exception as e:
+        print(f"Warning: Could not load metadata CSV: {e}")
+        print("Continuing without metadata...")
+        return MetadataIndex({}, [])
+
+    source = f" (cached in {METADATA_CACHE})" if from_cache else ""
+    print(f"Loaded metadata for {len(metadata_index)} files{source}")
+    if metadata_index.errors:
+        print(f"Warning: {len(metadata_index.errors)} invalid values were left out of the metadata:")
+        for line_num, field, value in metadata_index.errors[:20]:
+            print(f"  - line {line_num}: {field}={value!r}")
+        if len(metadata_index.errors) > 20:
+            print(f"  ... and {len(metadata_index.errors) - 20} more")
+    return metadata_index
 
-if skipped_files:
-    print("\nSkipping already uploaded files:")
-    for name in skipped_files:
-        print(f"  - {name}")
 
-# Upload and import each file to the File Search store
-operations = []
-for file_path in files_to_upload:
+def fetch_existing_documents(client, store_name):
+    # Get list of already uploaded documents
+    print("\nFetching existing documents from file search store...")
+    existing_documents = {}
     try:
-        print(f"\nUploading: {file_path}")
-        
-        # Prepare custom metadata
-        custom_metadata = []
-        file_metadata = metadata_by_filename.get(file_path.name, {})
-        
-        if file_metadata:
-            # Add article_name
-            if file_metadata.get('article_name'):
-                custom_metadata.append(
-                    types.CustomMetadata(
-                        key='article_name',
-                        string_value=file_metadata['article_name']
-                    )
-                )
-            
-            # Add is_archived
-            if file_metadata.get('is_archived'):
-                custom_metadata.append(
-                    types.CustomMetadata(
-                        key='is_archived',
-                        numeric_value=int(file_metadata['is_archived']) if file_metadata['is_archived'].isdigit() else 0
-                    )
-                )
-            
-            # Add is_news
-            if file_metadata.get('is_news'):
-                custom_metadata.append(
-                    types.CustomMetadata(
-                        key='is_news',
-                        numeric_value=int(file_metadata['is_news']) if file_metadata['is_news'].isdigit() else 0
-                    )
-                )
-            
-            # Add article_year
-            if file_metadata.get('article_year') and file_metadata['article_year'] != 'NULL':
-                custom_metadata.append(
-                    types.CustomMetadata(
-                        key='article_year',
-                        numeric_value=int(file_metadata['article_year'])
-                    )
-                )
-            
-            print(f"  Metadata: {len(custom_metadata)} fields added")
-        else:
-            print(f"  Warning: No metadata found for {file_path.name}")
-        
+        for document in client.file_search_stores.documents.list(
+            parent=store_name
+        ):
+            existing_documents[document.display_name] = document.name
+        print(f"Found {len(existing_documents)} existing documents")
+    except Exception as e:
+        print(f"Note: Could not fetch existing documents: {e}")
+    return existing_documents
+
+
+def adopt_existing_documents(manifest, scanned, existing_documents):
+    # Record local files that already have a document with the same display
+    # name, so they are not uploaded again
+    adopted = 0
+    for relative, (file_path, size, mtime_ns) in scanned.items():
+        document_name = existing_documents.get(file_path.name)
+        if document_name:
+            manifest.record(relative, hash_file(file_path), size, mtime_ns, document_name)
+            adopted += 1
+    print(f"Adopted {adopted} existing documents into the manifest")
+
+
+def upload_file(client, store_name, file_path, metadata_index):
+    # Upload and import a single file, returning a per-file result record.
+    # Runs on a worker thread, so it only returns data and never prints.
+    result = {
+        'file_name': file_path.name,
+        'path': file_path,
+        'size': 0,
+        'metadata_fields': None,
+        'operation': None,
+        'error': None,
+        'seconds': 0.0,
+    }
+    started = time.perf_counter()
+    try:
+        result['size'] = file_path.stat().st_size
+
+        custom_metadata = metadata_index.get(file_path.name)
+        if custom_metadata is not None:
+            result['metadata_fields'] = len(custom_metadata)
+
         # Upload and import the file into the File Search store
         config = {
             'display_name': file_path.name,
         }
         if custom_metadata:
-            config['custom_metadata'] = custom_metadata
-        
-        operation = client.file_search_stores.upload_to_file_search_store(
+            config['custom_metadata'] = list(custom_metadata)
+
+        result['operation'] = client.file_search_stores.upload_to_file_search_store(
             file=str(file_path),
-            file_search_store_name=file_search_store.name,
+            file_search_store_name=store_name,
             config=config
         )
-        
-        operations.append((file_path.name, operation))
-        print(f"Upload initiated for: {file_path.name}")
-        
     except Exception as e:
-        print(f"Error uploading {file_path}: {e}")
+        result['error'] = e
+    result['seconds'] = time.perf_counter() - started
+    return result
 
-# Wait for all operations to complete
-print("\n" + "="*60)
-print("Waiting for all uploads to complete...")
-print("="*60)
 
-for file_name, operation in operations:
-    try:
-        
-        operation = client.operations.get(operation)
-        
-        # Wait until import is complete
-        while not operation.done:
-            time.sleep(1)
-            operation = client.operations.get(operation)
-        
-        if operation.error:
-            print(f"❌ {file_name}: Error - {operation.error}")
+def report_upload_result(result):
+    print(f"\nFile: {result['path']}")
+    if result['metadata_fields'] is not None:
+        print(f"  Metadata: {result['metadata_fields']} fields added")
+    else:
+        print(f"  Warning: No metadata found for {result['file_name']}")
+    if result['error'] is not None:
+        print(f"Error uploading {result['path']}: {result['error']}")
+    else:
+        print(f"Upload initiated for: {result['file_name']} ({result['seconds']:.2f}s)")
+
+
+def upload_files(client, store_name, files_to_upload, metadata_index, workers, max_in_flight, on_uploaded=None):
+    # Upload files on a worker pool. At most max_in_flight uploads are
+    # submitted at once so a large tree does not queue every file up front.
+    # on_uploaded(result) is called from the calling thread for each upload.
+    results = []
+    if not files_to_upload:
+        return results
+
+    def finished(result):
+        results.append(result)
+        report_upload_result(result)
+        if on_uploaded:
+            on_uploaded(result)
+
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload') as executor:
+        for file_path in files_to_upload:
+            # Report finished uploads while waiting for a free slot
+            while len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished(future.result())
+            pending.add(executor.submit(
+                upload_file, client, store_name, file_path, metadata_index
+            ))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished(future.result())
+
+    return results
+
+
+def print_upload_summary(results, elapsed, workers, max_in_flight):
+    succeeded = [r for r in results if r['error'] is None]
+    failed = [r for r in results if r['error'] is not None]
+    total_bytes = sum(r['size'] for r in succeeded)
+    files_per_second = len(succeeded) / elapsed if elapsed > 0 else 0.0
+    bytes_per_second = total_bytes / elapsed if elapsed > 0 else 0.0
+    average_seconds = sum(r['seconds'] for r in results) / len(results) if results else 0.0
+
+    print("\n" + "="*60)
+    print("Upload summary")
+    print("="*60)
+    print(f"Workers: {workers} (max in flight: {max_in_flight})")
+    print(f"Uploaded: {len(succeeded)}")
+    print(f"Failed: {len(failed)}")
+    print(f"Bytes uploaded: {total_bytes}")
+    print(f"Wall time: {elapsed:.2f}s")
+    print(f"Average per-file upload time: {average_seconds:.2f}s")
+    print(f"Throughput: {files_per_second:.2f} files/s, {bytes_per_second / 1024:.1f} KiB/s")
+
+    if failed:
+        print("\nFailed uploads:")
+        for r in failed:
+            print(f"  - {r['file_name']}: {r['error']}")
+
+
+def wait_for_operations(client, results, poll_rate, on_imported=None):
+    # Wait for all operations to complete. Every pending import is polled
+    # together and reported as soon as it finishes. Returns the imported
+    # files, the failed ones to upload again, and {file: operation} for
+    # imports whose status could not be polled.
+    print("\n" + "="*60)
+    print("Waiting for all uploads to complete...")
+    print("="*60)
+
+    tracker = OperationTracker(client, max_polls_per_second=poll_rate)
+    for r in results:
+        if r['error'] is None:
+            tracker.add(r['path'], r['operation'])
+
+    def report(file_path, operation, error):
+        if error is None:
+            print(f"✓ {file_path.name}: Successfully imported")
+            if on_imported:
+                on_imported(file_path, operation)
         else:
-            print(f"✓ {file_name}: Successfully imported")
-            
-    except Exception as e:
-        print(f"❌ {file_name}: Exception - {e}")
-
-print("\n" + "="*60)
-print("All uploads completed!")
-print("="*60)
-print(f"\nFile Search Store Name: {file_search_store.name}")
-print(f"Display Name: {file_search_store.display_name}")
-print(f"New files uploaded: {len(operations)}")
-print(f"Total documents in store: {len(existing_documents) + len(operations)}")
-print(f"\nStore name saved to: {STORE_NAME_FILE}")
-
-# Example of how to use the file search store in a query
-print("\n" + "="*60)
-print("Example usage:")
-print("="*60)
-print("""
+            print(f"❌ {file_path.name}: Error - {error}")
+
+    started = time.perf_counter()
+    succeeded, retry_queue = tracker.run(on_complete=report)
+    print(f"\nImports finished in {time.perf_counter() - started:.2f}s ({tracker.polls} status polls)")
+    return [path for path, _ in succeeded], [path for path, _ in retry_queue], dict(tracker.unpolled)
+
+
+def delete_documents(client, document_names, workers):
+    # Delete documents (and their chunks) from the store in parallel.
+    # Returns the names that could not be deleted.
+    def delete(document_name):
+        try:
+            client.file_search_stores.documents.delete(
+                name=document_name, config={'force': True}
+            )
+            return None
+        except Exception as e:
+            return e
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='delete') as executor:
+        for document_name, error in zip(document_names, executor.map(delete, document_names)):
+            if error is not None:
+                print(f"❌ Could not delete {document_name}: {error}")
+                failed.append(document_name)
+    return failed
+
+
+def sync_store(client, args, file_search_store, scanned, metadata_index, manifest_path):
+    # Bring one store in line with the scanned files: upload new and
+    # modified files, delete replaced and removed ones. Returns the number
+    # of documents in the store.
+    manifest = Manifest(manifest_path)
+    if not manifest.bind_store(file_search_store.name) or args.rebuild_manifest:
+        # First run against this store: adopt documents uploaded earlier,
+        # matched by display name as before
+        existing_documents = fetch_existing_documents(client, file_search_store.name)
+        adopt_existing_documents(manifest, scanned, existing_documents)
+
+    plan = compute_sync_plan(scanned, manifest.entries(), args.workers)
+    if plan.touched:
+        manifest.touch(plan.touched)
+
+    print(f"\nFound {len(scanned)} total files")
+    print(f"Unchanged: {len(plan.unchanged)}")
+    print(f"New files to upload: {len(plan.new)}")
+    print(f"Modified files to re-upload: {len(plan.modified)}")
+    print(f"Deleted files to remove from store: {len(plan.deleted)}")
+
+    pending = {file_path: (relative, size, mtime_ns, sha256)
+               for relative, file_path, size, mtime_ns, sha256 in plan.new + plan.modified}
+    entries = manifest.entries()
+    replaced_documents = []
+
+    def on_uploaded(result):
+        # Saved before polling, so an interrupted run polls the import
+        # again instead of uploading a duplicate
+        if result['error'] is None:
+            relative, _, _, sha256 = pending[result['path']]
+            manifest.save_operation(relative, sha256, result['operation'].name)
+
+    def on_imported(file_path, operation):
+        relative, size, mtime_ns, sha256 = pending[file_path]
+        document_name = operation.response.document_name
+        previous = entries.get(relative)
+        if previous and previous['document_name'] != document_name:
+            replaced_documents.append(previous['document_name'])
+        manifest.record(relative, sha256, size, mtime_ns, document_name)
+
+    # Imports an earlier run started for the same content are polled
+    # before anything is uploaded again; the rest are stale
+    paths = {relative: file_path for file_path, (relative, _, _, _) in pending.items()}
+    unpolled = {}
+    for relative, (sha256, operation_name) in manifest.operations().items():
+        if relative in paths and pending[paths[relative]][3] == sha256:
+            unpolled[paths[relative]] = types.UploadToFileSearchStoreOperation(name=operation_name)
+        else:
+            manifest.remove_operation(relative)
+    if unpolled:
+        print(f"Imports of an earlier run to check: {len(unpolled)}")
+    files_to_upload = [file_path for file_path in pending if file_path not in unpolled]
+
+    # Upload and import the files to the File Search store in parallel,
+    # re-uploading failed files up to --max-retries times. Imports that
+    # could not be polled are polled again rather than uploaded again.
+    imported = []
+    failed = []
+    attempt = 0
+    while files_to_upload or unpolled:
+        if attempt:
+            print(f"\nRetrying {len(files_to_upload)} failed files and {len(unpolled)} unconfirmed imports "
+                  f"(attempt {attempt} of {args.max_retries})...")
+        started = time.perf_counter()
+        results = upload_files(
+            client, file_search_store.name, files_to_upload, metadata_index,
+            args.workers, args.max_in_flight, on_uploaded
+        )
+        if results:
+            print_upload_summary(results, time.perf_counter() - started, args.workers, args.max_in_flight)
+        results += [{'path': file_path, 'operation': operation, 'error': None} for file_path, operation in unpolled.items()]
+
+        succeeded, retry_queue, unpolled = wait_for_operations(client, results, args.poll_rate, on_imported)
+        imported.extend(succeeded)
+        for file_path in retry_queue:
+            manifest.remove_operation(pending[file_path][0])
+        retry_queue.extend(r['path'] for r in results if r['error'] is not None)
+
+        attempt += 1
+        if attempt > args.max_retries:
+            failed = retry_queue
+            break
+        files_to_upload = retry_queue
+
+    # Remove the old versions of re-uploaded files and documents whose
+    # source file is gone
+    if replaced_documents:
+        print(f"\nDeleting {len(replaced_documents)} replaced documents...")
+        delete_documents(client, replaced_documents, args.workers)
+    if plan.deleted and not args.keep_orphans:
+        print(f"\nDeleting {len(plan.deleted)} documents of removed files...")
+        not_deleted = set(delete_documents(client, [name for _, name in plan.deleted], args.workers))
+        for relative, document_name in plan.deleted:
+            if document_name not in not_deleted:
+                manifest.remove(relative)
+
+    print("\n" + "="*60)
+    print("All uploads completed!")
+    print("="*60)
+    print(f"\nFile Search Store Name: {file_search_store.name}")
+    print(f"Display Name: {file_search_store.display_name}")
+    print(f"Files uploaded: {len(imported)}")
+    if failed:
+        print(f"Failed after {args.max_retries} retries: {len(failed)}")
+        for file_path in failed:
+            print(f"  - {file_path}")
+    if unpolled:
+        print(f"Imports with unknown status, checked again on the next run: {len(unpolled)}")
+        for file_path in unpolled:
+            print(f"  - {file_path}")
+    documents = len(manifest)
+    print(f"Total documents in store: {documents}")
+    print(f"Manifest saved to: {manifest_path}")
+    manifest.close()
+    return documents
+
+
+def print_api_stats(stats):
+    print(f"\nAPI calls: {stats['calls']}, throttled: {stats['throttled']} ({stats['throttled_seconds']:.1f}s), "
+          f"retried: {stats['retried']}, rate limited (429): {stats['rate_limited']}, failed: {stats['failed']}")
+
+
+def print_example_usage(store_names):
+    print("\n" + "="*60)
+    print("Example usage:")
+    print("="*60)
+    print(f"""
 response = client.models.generate_content(
     model="gemini-2.5-flash",
     contents="Your question here",
@@ -223,7 +501,7 @@ response = client.models.generate_content(
         tools=[
             types.Tool(
                 file_search=types.FileSearch(
-                    file_search_store_names=['{file_search_store.name}']
+                    file_search_store_names={store_names!r}
                 )
             )
         ]
@@ -231,3 +509,87 @@ response = client.models.generate_content(
 )
 print(response.text)
 """)
+
+
+def run(client, args):
+    metadata_index = load_metadata(args)
+
+    source_dir = SOURCE_DIR
+    if args.convert:
+        print()
+        convert(source_dir, CONVERTED_DIR, args.preprocess_workers)
+        source_dir = CONVERTED_DIR
+    if args.preprocess:
+        print()
+        preprocess(source_dir, PROCESSED_DIR, args.preprocess_workers)
+        source_dir = PROCESSED_DIR
+
+    # Scan the source tree once and compare it with the local manifest
+    print(f"\nScanning {source_dir}...")
+    scanned = scan_source_files(source_dir)
+
+    if not args.partition:
+        file_search_store = get_or_create_store(client)
+        sync_store(client, args, file_search_store, scanned, metadata_index, MANIFEST_FILE)
+        print(f"\nStore name saved to: {STORE_NAME_FILE}")
+        print_example_usage([file_search_store.name])
+        return
+
+    # One store and manifest per partition; partitions that lost all their
+    # files are synced too, so their documents get deleted
+    layout = StorePartitions.load(PARTITIONS_FILE) if os.path.exists(PARTITIONS_FILE) else StorePartitions()
+    if layout.year_bounds != args.partition_years:
+        print(f"Year ranges changed from {layout.year_bounds} to {args.partition_years}, documents will move between partitions")
+        layout.year_bounds = args.partition_years
+    groups = {}
+    for relative, entry in scanned.items():
+        partition = partition_for(metadata_index.get(entry[0].name), layout.year_bounds)
+        layout.partitions.setdefault(partition.id, partition)
+        groups.setdefault(partition.id, {})[relative] = entry
+
+    selected = args.only_partition or sorted(layout.partitions)
+    unknown = [partition_id for partition_id in selected if partition_id not in layout.partitions]
+    if unknown:
+        print(f"Unknown partitions: {', '.join(unknown)}")
+        print(f"Known partitions: {', '.join(sorted(layout.partitions))}")
+        return
+
+    for partition_id in selected:
+        partition = layout.partitions[partition_id]
+        print("\n" + "="*60)
+        print(f"Partition {partition_id}: {len(groups.get(partition_id, {}))} files")
+        print("="*60)
+        file_search_store = get_or_create_partition_store(client, partition)
+        layout.save(PARTITIONS_FILE)
+        documents = sync_store(
+            client, args, file_search_store, groups.get(partition_id, {}), metadata_index,
+            f"upload_manifest.{partition_id}.db"
+        )
+        if not documents and partition_id not in groups:
+            # Keep the layout to partitions that hold documents; the empty
+            # store itself is left in place
+            print(f"Partition {partition_id} is empty, removing it from {PARTITIONS_FILE}")
+            del layout.partitions[partition_id]
+
+    layout.save(PARTITIONS_FILE)
+    print(f"\nPartition layout saved to: {PARTITIONS_FILE}")
+    for partition_id, partition in sorted(layout.partitions.items()):
+        print(f"  {partition_id}: {partition.store_name} ({len(groups.get(partition_id, {}))} files)")
+    print_example_usage(layout.store_names())
+
+
+def main():
+    args = parse_args()
+
+    # Initialize the Gemini API client; uploads are bulk traffic and yield
+    # to chat calls sharing the limiter
+    client = RateLimitedClient(
+        genai.Client(api_key='***REMOVED***'),
+        RateLimiter(args.requests_per_minute), BULK, args.api_retries
+    )
+    run(client, args)
+    print_api_stats(client.stats())
+
+
+if __name__ == '__main__':
+    main()